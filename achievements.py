@@ -0,0 +1,276 @@
+"""
+achievements.py - Declarative achievements, evaluated incrementally
+
+RULES describes every achievement as data: a metric, a threshold and its
+display text. The metrics are:
+
+    entries          number of entries
+    streak           longest run of consecutive days with an entry
+    exercises        entries with an exercise (or one "exercise" type)
+    exercise_types   distinct exercise types tried
+    positive         entries with sentiment >= "min_sentiment"
+
+Each user's progress is stored in ACHIEVEMENTS_FILE, next to their entries
+(so it is sharded the same way). Progress holds the entry count, entries
+per day, exercise counts and a sentiment histogram. on_insert() updates it
+for one new entry and then checks the rules. A page view only reads the
+stored unlocks, so adding rules costs nothing per request. A user with
+entries but no record yet, such as one from before achievements existed,
+is seeded from their saved entries on first use. Deleted accounts lose
+their record when tombstones are compacted. Single entries are never
+deleted, so progress only counts inserts.
+Unlocks are permanent and record when they happened. New rules are checked
+at each user's next entry, or straight away with a backfill:
+
+    python achievements.py backfill
+"""
+
+import os
+import sys
+import json
+import argparse
+from datetime import date, datetime, timedelta
+
+from dotenv import load_dotenv
+
+import records
+import sharding
+import sentiment
+import tombstones
+
+load_dotenv()
+
+ACHIEVEMENTS_FILE = "achievements.json"
+ENTRIES_FILE = "entries.json"
+
+RULES = [
+    {"id": "first_entry", "name": "Getting Started", "icon": "🌱", "desc": "Record your first entry",
+     "metric": "entries", "threshold": 1},
+    {"id": "entries_7", "name": "Consistent", "icon": "📝", "desc": "Log 7 entries",
+     "metric": "entries", "threshold": 7},
+    {"id": "entries_30", "name": "Dedicated", "icon": "⭐", "desc": "Log 30 entries",
+     "metric": "entries", "threshold": 30},
+    {"id": "streak_3", "name": "Warming Up", "icon": "✨", "desc": "Check in 3 days in a row",
+     "metric": "streak", "threshold": 3},
+    {"id": "streak_7", "name": "On Fire!", "icon": "🔥", "desc": "Check in 7 days in a row",
+     "metric": "streak", "threshold": 7},
+    {"id": "streak_30", "name": "Unstoppable", "icon": "🏆", "desc": "Check in 30 days in a row",
+     "metric": "streak", "threshold": 30},
+    {"id": "exercise_10", "name": "Active Mind", "icon": "🏃", "desc": "Log 10 exercises",
+     "metric": "exercises", "threshold": 10},
+    {"id": "exercise_types_3", "name": "Explorer", "icon": "🧭", "desc": "Try 3 different exercises",
+     "metric": "exercise_types", "threshold": 3},
+    {"id": "breathing_5", "name": "Deep Breather", "icon": "🌬️", "desc": "Complete 5 breathing exercises",
+     "metric": "exercises", "exercise": "Breathing", "threshold": 5},
+    {"id": "positive_5", "name": "Bright Side", "icon": "☀️", "desc": "Write 5 upbeat journal entries",
+     "metric": "positive", "min_sentiment": 0.3, "threshold": 5},
+]
+
+
+# ==================== PROGRESS ====================
+
+def new_progress():
+    return {"entries": 0, "days": {}, "best_streak": 0, "exercises": {}, "sentiment": {}}
+
+
+def _bucket(score):
+    """Sentiment histogram bucket: tenths from -10 to 10"""
+    return str(max(-10, min(int(score * 10 // 1), 10)))
+
+
+def _entry_facts(entry):
+    day = (entry.get("date") or "")[:10]
+    exercise = entry.get("exercise")
+    if not exercise or exercise == "None":
+        exercise = None
+    score = entry.get("sentiment")
+    if not isinstance(score, (int, float)):
+        # CLI entries are not scored when saved
+        score = sentiment.get_engine().score(entry.get("journal") or "")
+    return day, exercise, score
+
+
+def _run_through(days, day):
+    """Length of the run of consecutive active days that includes day"""
+    try:
+        center = date.fromisoformat(day)
+    except ValueError:
+        return 0
+    length = 1
+    for step in (-1, 1):
+        d = center + timedelta(days=step)
+        while d.isoformat() in days:
+            length += 1
+            d += timedelta(days=step)
+    return length
+
+
+def apply_insert(progress, entry):
+    day, exercise, score = _entry_facts(entry)
+    progress["entries"] += 1
+    if len(day) == 10:
+        days = progress["days"]
+        days[day] = days.get(day, 0) + 1
+        if days[day] == 1:
+            progress["best_streak"] = max(progress["best_streak"], _run_through(days, day))
+    if exercise:
+        progress["exercises"][exercise] = progress["exercises"].get(exercise, 0) + 1
+    bucket = _bucket(score)
+    progress["sentiment"][bucket] = progress["sentiment"].get(bucket, 0) + 1
+    return progress
+
+
+def metric_value(progress, rule):
+    metric = rule["metric"]
+    if metric == "entries":
+        return progress["entries"]
+    if metric == "streak":
+        return progress["best_streak"]
+    if metric == "exercises":
+        if rule.get("exercise"):
+            return progress["exercises"].get(rule["exercise"], 0)
+        return sum(progress["exercises"].values())
+    if metric == "exercise_types":
+        return len(progress["exercises"])
+    if metric == "positive":
+        floor = rule.get("min_sentiment", 0.0)
+        return sum(n for bucket, n in progress["sentiment"].items() if int(bucket) / 10 >= floor)
+    raise ValueError(f"unknown achievement metric: {metric}")
+
+
+def evaluate(record, when=None):
+    """Unlock every rule the progress now satisfies; returns the new unlocks"""
+    stamp = (when or datetime.now()).isoformat()
+    unlocked = record["unlocked"]
+    new = []
+    for rule in RULES:
+        if rule["id"] not in unlocked and metric_value(record["progress"], rule) >= rule["threshold"]:
+            unlocked[rule["id"]] = stamp
+            new.append(dict(rule, unlocked_at=stamp))
+    return new
+
+
+# ==================== STORAGE ====================
+
+def _read(path):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def load_record(username):
+    """Stored {"progress", "unlocked"} for a user, or None if there is none yet"""
+    if tombstones.is_deleted(username):
+        return None
+    for path, _ in sharding.read_paths(ACHIEVEMENTS_FILE, username):
+        record = _read(path).get(username)
+        if record is not None:
+            return record
+    return None
+
+
+def _store(username, record):
+    path = sharding.write_path(ACHIEVEMENTS_FILE, username)
+    data = _read(path)
+    data[username] = record
+    sharding.write_json_atomic(path, data)
+
+
+def _seeded(username):
+    """A record rebuilt from every entry the user has saved"""
+    progress = new_progress()
+    for entry in records.load_user_entries(ENTRIES_FILE, username):
+        apply_insert(progress, entry)
+    return {"progress": progress, "unlocked": {}}
+
+
+def on_insert(username, entry, when=None):
+    """Record an entry that has just been saved; returns the achievements it unlocked"""
+    with sharding.lock_for(username):
+        record = load_record(username)
+        if record is None:
+            # No record yet, e.g. a user from before achievements: count every
+            # saved entry, this one included
+            record = _seeded(username)
+        else:
+            apply_insert(record["progress"], entry)
+        new = evaluate(record, when)
+        _store(username, record)
+    return new
+
+
+def _seed(username):
+    """Create the record of a user who has entries but no record yet; None if they have none"""
+    with sharding.lock_for(username):
+        record = load_record(username)
+        if record is None:
+            record = _seeded(username)
+            if not record["progress"]["entries"]:
+                return None
+            evaluate(record)
+            _store(username, record)
+    return record
+
+
+def unlocked(username):
+    """A user's unlocked achievements in RULES order, each with "unlocked_at" """
+    record = load_record(username)
+    if record is None and not tombstones.is_deleted(username):
+        record = _seed(username)
+    if not record:
+        return []
+    stamps = record["unlocked"]
+    return [dict(rule, unlocked_at=stamps[rule["id"]]) for rule in RULES if rule["id"] in stamps]
+
+
+# ==================== BACKFILL ====================
+
+def backfill(entries_file=None, when=None):
+    """Rebuild every user's progress from their entries and evaluate all rules.
+
+    Existing unlock times are kept. Returns (users, new_unlocks).
+    """
+    dead = tombstones.deleted_usernames()
+    with sharding.lock_for():
+        progress = {}
+        # Mid-rebalance a moving user's entries are counted once, not per shard
+        for entry in records.iter_all_entries(entries_file or ENTRIES_FILE):
+            if entry.username and entry.username not in dead:
+                apply_insert(progress.setdefault(entry.username, new_progress()), entry)
+        by_path = {}
+        for username in progress:
+            by_path.setdefault(sharding.write_path(ACHIEVEMENTS_FILE, username), []).append(username)
+        new_unlocks = 0
+        for path, usernames in by_path.items():
+            data = _read(path)
+            for username in usernames:
+                record = {"progress": progress[username], "unlocked": dict(data.get(username, {}).get("unlocked", {}))}
+                new_unlocks += len(evaluate(record, when))
+                data[username] = record
+            sharding.write_json_atomic(path, data)
+    return len(progress), new_unlocks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Achievements engine")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("backfill", help="evaluate all rules over existing entries once")
+    p_show = sub.add_parser("show", help="list a user's unlocked achievements")
+    p_show.add_argument("username")
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill":
+        users, new = backfill()
+        print(f"[OK] Evaluated {len(RULES)} rules for {users} users; {new} new unlocks")
+    else:
+        for a in unlocked(args.username):
+            print(f"{a['icon']} {a['name']} - {a['desc']} (unlocked {a['unlocked_at'][:16]})")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
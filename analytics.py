@@ -0,0 +1,279 @@
+"""
+analytics.py - Population-level metrics for operators
+
+Entries are folded into per-day partial aggregates in a single pass. Each
+day holds mood counts, sentiment sum and count, exercise counts and the set
+of active users. Partials merge by adding counters and taking set unions, so
+shards (or any other split of the entries) can be aggregated in separate
+processes and combined afterwards.
+
+Aggregates for closed days (before today) are cached in ANALYTICS_CACHE_FILE.
+Later runs skip entries from cached days before doing any aggregation work,
+so in practice only today is recomputed. Cached days that include a deleted
+account are re-aggregated, and tombstone compaction drops them from the
+file. While shards are rebalancing, entries are read in a single pass that
+counts a moving user's copies once. Run with --rebuild after backfills that
+touch past days.
+
+    python analytics.py --days 14
+"""
+
+import os
+import sys
+import json
+import argparse
+from collections import Counter
+from datetime import date, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from dotenv import load_dotenv
+
+import records
+import sharding
+import tombstones
+
+load_dotenv()
+
+ENTRIES_FILE = "entries.json"
+ANALYTICS_CACHE_FILE = os.getenv("ANALYTICS_CACHE_FILE", "analytics_cache.json")
+
+
+class DayAggregate:
+    """Mergeable partial aggregate for one calendar day"""
+
+    __slots__ = ("entries", "moods", "sentiment_sum", "sentiment_n", "exercise_entries", "exercises", "users",
+                 "exercise_users")
+
+    def __init__(self):
+        self.entries = 0
+        self.moods = Counter()
+        self.sentiment_sum = 0.0
+        self.sentiment_n = 0
+        self.exercise_entries = 0
+        self.exercises = Counter()
+        self.users = set()
+        self.exercise_users = set()
+
+    def add(self, entry):
+        self.entries += 1
+        self.moods[entry.get("mood") or "Unknown"] += 1
+        sentiment = entry.get("sentiment")
+        if isinstance(sentiment, (int, float)):
+            self.sentiment_sum += sentiment
+            self.sentiment_n += 1
+        username = entry.get("username")
+        if username:
+            self.users.add(username)
+        exercise = entry.get("exercise")
+        if exercise and exercise != "None":
+            self.exercise_entries += 1
+            self.exercises[exercise] += 1
+            if username:
+                self.exercise_users.add(username)
+
+    def merge(self, other):
+        self.entries += other.entries
+        self.moods.update(other.moods)
+        self.sentiment_sum += other.sentiment_sum
+        self.sentiment_n += other.sentiment_n
+        self.exercise_entries += other.exercise_entries
+        self.exercises.update(other.exercises)
+        self.users |= other.users
+        self.exercise_users |= other.exercise_users
+        return self
+
+    def to_dict(self):
+        return {
+            "entries": self.entries,
+            "moods": dict(self.moods),
+            "sentiment_sum": self.sentiment_sum,
+            "sentiment_n": self.sentiment_n,
+            "exercise_entries": self.exercise_entries,
+            "exercises": dict(self.exercises),
+            "users": sorted(self.users),
+            "exercise_users": sorted(self.exercise_users),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        agg = cls()
+        agg.entries = data["entries"]
+        agg.moods = Counter(data["moods"])
+        agg.sentiment_sum = data["sentiment_sum"]
+        agg.sentiment_n = data["sentiment_n"]
+        agg.exercise_entries = data["exercise_entries"]
+        agg.exercises = Counter(data["exercises"])
+        agg.users = set(data["users"])
+        agg.exercise_users = set(data["exercise_users"])
+        return agg
+
+
+def entry_day(entry):
+    """"YYYY-MM-DD" for any of the date formats the two apps write"""
+    return (entry.get("date") or "")[:10]
+
+
+def aggregate(entries, skip_days=(), since=""):
+    """Fold entries into {day: DayAggregate}, ignoring skip_days and days before since"""
+    days = {}
+    for entry in entries:
+        day = entry_day(entry)
+        if len(day) != 10 or day < since or day in skip_days:
+            continue
+        agg = days.get(day)
+        if agg is None:
+            agg = days[day] = DayAggregate()
+        agg.add(entry)
+    return days
+
+
+def merge_partials(partials):
+    merged = {}
+    for partial in partials:
+        for day, agg in partial.items():
+            if day in merged:
+                merged[day].merge(agg)
+            else:
+                merged[day] = agg
+    return merged
+
+
+def aggregate_records(rows, skip_days=(), since=""):
+    """Aggregate raw entry records, leaving out deleted accounts"""
+    dead = tombstones.deleted_usernames()
+    entries = (e for e in rows if isinstance(e, dict) and e.get("username") not in dead)
+    try:
+        return aggregate(entries, frozenset(skip_days), since)
+    except ValueError:
+        return {}
+
+
+def aggregate_file(path, skip_days=(), since=""):
+    """Aggregate one entries file; picklable so it can run in a worker process"""
+    return aggregate_records(records.iter_records(path), skip_days, since)
+
+
+# ==================== CACHE ====================
+
+def load_cache(path=None):
+    path = path or ANALYTICS_CACHE_FILE
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return {day: DayAggregate.from_dict(d) for day, d in json.load(f).items()}
+    except Exception:
+        return {}
+
+
+def save_cache(days, path=None):
+    path = path or ANALYTICS_CACHE_FILE
+    sharding.write_json_atomic(path, {day: agg.to_dict() for day, agg in sorted(days.items())})
+
+
+def _cache_lock(path=None):
+    return sharding.file_lock((path or ANALYTICS_CACHE_FILE) + ".lock")
+
+
+def forget_users(usernames, path=None):
+    """Drop cached days that include deleted accounts; returns how many were dropped"""
+    with _cache_lock(path):
+        cached = load_cache(path)
+        kept = {day: agg for day, agg in cached.items() if not agg.users & usernames}
+        if len(kept) != len(cached):
+            save_cache(kept, path)
+    return len(cached) - len(kept)
+
+
+def collect(entries_file=None, days=30, workers=None, use_cache=True, today=None):
+    """Per-day aggregates for the last `days` days, reusing cached closed days"""
+    today = today or date.today()
+    since = (today - timedelta(days=days - 1)).isoformat()
+    today_key = today.isoformat()
+    cached = load_cache() if use_cache else {}
+    dead = tombstones.deleted_usernames()
+    if dead:
+        # Recompute days that still count accounts deleted since they were cached
+        cached = {day: agg for day, agg in cached.items() if not agg.users & dead}
+    skip = frozenset(day for day in cached if day < today_key)
+
+    paths = [p for p, _ in sharding.read_paths(entries_file or ENTRIES_FILE)]
+    if sharding.rebalancing():
+        # A moving user's entries can be on two shards at once; one pass over
+        # every shard counts each entry once, where per-shard partials would not
+        partials = [aggregate_records(records.iter_all_records(entries_file or ENTRIES_FILE), skip, since)]
+    elif workers and workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            partials = list(pool.map(aggregate_file, paths, [skip] * len(paths), [since] * len(paths)))
+    else:
+        partials = [aggregate_file(p, skip, since) for p in paths]
+    fresh = merge_partials(partials)
+
+    if use_cache:
+        closed = {day: agg for day, agg in fresh.items() if day < today_key}
+        if closed:
+            cached.update(closed)
+            # Merge into the file as it is now; another request may have saved meanwhile
+            with _cache_lock():
+                latest = load_cache()
+                latest.update(closed)
+                save_cache(latest)
+    result = {day: agg for day, agg in cached.items() if since <= day < today_key}
+    result.update(fresh)
+    return result
+
+
+# ==================== METRICS ====================
+
+def build_metrics(days_agg, days=30, today=None):
+    """Turn per-day aggregates into the operator metrics payload"""
+    today = today or date.today()
+    series = []
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        agg = days_agg.get(day) or DayAggregate()
+        series.append({
+            "date": day,
+            "entries": agg.entries,
+            "active_users": len(agg.users),
+            "avg_sentiment": round(agg.sentiment_sum / agg.sentiment_n, 3) if agg.sentiment_n else None,
+            "mood_distribution": dict(agg.moods),
+            "exercise_entries": agg.exercise_entries,
+            "exercises": dict(agg.exercises),
+        })
+
+    week = DayAggregate()
+    for offset in range(7):
+        agg = days_agg.get((today - timedelta(days=offset)).isoformat())
+        if agg is not None:
+            week.merge(agg)
+    today_agg = days_agg.get(today.isoformat()) or DayAggregate()
+    return {
+        "generated_for": today.isoformat(),
+        "dau": len(today_agg.users),
+        "wau": len(week.users),
+        "exercise_adoption_7d": round(len(week.exercise_users) / len(week.users), 3) if week.users else 0.0,
+        "top_exercises_7d": dict(week.exercises.most_common(5)),
+        "days": series,
+    }
+
+
+def get_metrics(entries_file=None, days=30, workers=None, use_cache=True):
+    days = max(7, min(int(days), 366))
+    return build_metrics(collect(entries_file, days, workers, use_cache), days)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Population metrics over all entries")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--workers", type=int, default=None, help="aggregate shards in parallel")
+    parser.add_argument("--rebuild", action="store_true", help="ignore and rewrite the closed-day cache")
+    args = parser.parse_args(argv)
+    if args.rebuild and os.path.exists(ANALYTICS_CACHE_FILE):
+        os.remove(ANALYTICS_CACHE_FILE)
+    print(json.dumps(get_metrics(days=args.days, workers=args.workers), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
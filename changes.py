@@ -0,0 +1,320 @@
+"""
+changes.py - Ordered change feed of user writes
+
+Every write the apps make (new entries, chat messages, account deletions)
+is appended to CHANGES_FILE as one JSON line carrying a sequence number.
+Sequence numbers increase by one across all processes. Downstream jobs keep
+the last sequence number they processed as their cursor and ask only for
+what came after it, instead of re-reading and diffing entries.json:
+
+    cursor = changes.ChangeCursor.resume("digest_job.cursor")
+    for change in cursor:
+        handle(change)
+        cursor.save()
+
+The web app serves the same feed at /api/changes?after=<seq> as a long-poll
+or as Server-Sent Events. Reads binary-search the file for the cursor, so
+the cost of a poll does not grow with the length of the log.
+
+Retention: records older than CHANGES_RETENTION_DAYS, or beyond the newest
+CHANGES_MAX_RECORDS, are dropped by compaction. Compaction runs after every
+CHANGES_COMPACT_EVERY appends or with `python changes.py compact`. The
+newest record is always kept so numbering never restarts. A cursor older
+than the oldest retained record has missed changes and must resync from
+a snapshot; read_after() reports that as "reset".
+
+Changes carry the written content (entry fields, chat text). When a
+deleted account is compacted, its changes keep their seq, type and
+username, but their data is cleared and "redacted" is set. The feed
+therefore never outlives the account's deletion.
+
+    python changes.py tail --after 0 --follow
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+import sharding
+
+load_dotenv()
+
+CHANGES_FILE = os.getenv("CHANGES_FILE", "changes.jsonl")
+RETENTION_DAYS = float(os.getenv("CHANGES_RETENTION_DAYS", "7"))
+MAX_RECORDS = int(os.getenv("CHANGES_MAX_RECORDS", "100000"))
+COMPACT_EVERY = int(os.getenv("CHANGES_COMPACT_EVERY", "1000"))
+
+# How often waiters re-check the file for appends made by other processes
+POLL_SECONDS = 0.5
+# Below this window, the cursor search switches from bisection to a scan
+_SCAN_BYTES = 4096
+
+# Wakes in-process waiters as soon as something is appended
+_appended = threading.Condition()
+_tail_key = None
+_tail_seq = 0
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _read_last_seq(path):
+    """Sequence number of the last complete line (0 for a missing/empty log)"""
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            block = min(end, _SCAN_BYTES)
+            while block:
+                f.seek(end - block)
+                lines = f.read(block).split(b"\n")
+                # lines[-1] is the text after the last newline (partial or empty)
+                for line in reversed(lines[1:-1] if block < end else lines[:-1]):
+                    if line.strip():
+                        return json.loads(line)["seq"]
+                if block == end:
+                    break
+                block = min(end, block * 2)
+    except (OSError, ValueError, KeyError):
+        pass
+    return 0
+
+
+def _last_seq():
+    global _tail_key, _tail_seq
+    key = _file_key(CHANGES_FILE)
+    if key is None or key != _tail_key:
+        _tail_key, _tail_seq = key, _read_last_seq(CHANGES_FILE)
+    return _tail_seq
+
+
+def record(kind, username, data=None):
+    """Append one change and return its sequence number"""
+    global _tail_key, _tail_seq
+    with sharding.file_lock(CHANGES_FILE + ".lock"):
+        seq = _last_seq() + 1
+        line = json.dumps({"seq": seq, "ts": datetime.now().isoformat(), "type": kind,
+                           "username": username, "data": data or {}}, ensure_ascii=False)
+        with open(CHANGES_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+        _tail_key, _tail_seq = _file_key(CHANGES_FILE), seq
+        if COMPACT_EVERY and seq % COMPACT_EVERY == 0:
+            compact()
+    with _appended:
+        _appended.notify_all()
+    return seq
+
+
+# ==================== READING ====================
+
+def _seq_of(line):
+    return json.loads(line)["seq"]
+
+
+def _offset_after(f, size, after):
+    """Byte offset of the first line with seq > after"""
+    lo, hi = 0, size
+    # Invariant: lo is a line start and every line before lo has seq <= after
+    while hi - lo > _SCAN_BYTES:
+        mid = (lo + hi) // 2
+        f.seek(mid)
+        f.readline()
+        start = f.tell()
+        line = f.readline()
+        if not line.endswith(b"\n"):
+            hi = mid
+        elif _seq_of(line) <= after:
+            lo = start + len(line)
+        else:
+            hi = mid
+    f.seek(lo)
+    while True:
+        line = f.readline()
+        if not line.endswith(b"\n") or _seq_of(line) > after:
+            return lo
+        lo += len(line)
+
+
+def read_after(after=0, limit=500):
+    """Changes with seq > after, oldest first.
+
+    Returns {"changes": [...], "next": cursor to pass next time, "reset":
+    True if records after `after` were already compacted away}.
+    """
+    changes = []
+    reset = False
+    try:
+        with open(CHANGES_FILE, "rb") as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(0)
+            first = f.readline()
+            # The oldest retained change is past the cursor: some were compacted away
+            reset = first.endswith(b"\n") and _seq_of(first) > after + 1
+            f.seek(_offset_after(f, size, after))
+            while len(changes) < limit:
+                line = f.readline()
+                # A line without its newline is still being written
+                if not line.endswith(b"\n"):
+                    break
+                changes.append(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return {"changes": changes, "next": changes[-1]["seq"] if changes else after, "reset": reset}
+
+
+def wait_after(after=0, timeout=25.0, limit=500):
+    """Like read_after, but blocks up to `timeout` seconds until there is something new"""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = read_after(after, limit)
+        remaining = deadline - time.monotonic()
+        if result["changes"] or result["reset"] or remaining <= 0:
+            return result
+        with _appended:
+            _appended.wait(min(POLL_SECONDS, remaining))
+
+
+class ChangeCursor:
+    """Resumable position in the change feed.
+
+    Iterating yields changes after `after`, waiting for new ones as they
+    arrive (stop with follow=False to end once caught up). `after` advances
+    as changes are yielded; save() stores it so resume() can continue later.
+    """
+
+    def __init__(self, after=0, state_path=None, follow=True, poll_timeout=25.0, batch=500):
+        self.after = after
+        self.state_path = state_path
+        self.follow = follow
+        self.poll_timeout = poll_timeout
+        self.batch = batch
+        self.reset = False
+
+    @classmethod
+    def resume(cls, state_path, **kwargs):
+        after = 0
+        if os.path.exists(state_path):
+            with open(state_path, "r", encoding="utf-8") as f:
+                after = json.load(f).get("after", 0)
+        return cls(after, state_path, **kwargs)
+
+    def save(self):
+        if not self.state_path:
+            return
+        sharding.write_json_atomic(self.state_path, {"after": self.after, "saved_at": datetime.now().isoformat()})
+
+    def __iter__(self):
+        while True:
+            if self.follow:
+                result = wait_after(self.after, self.poll_timeout, self.batch)
+            else:
+                result = read_after(self.after, self.batch)
+            if result["reset"]:
+                self.reset = True
+            for change in result["changes"]:
+                self.after = change["seq"]
+                yield change
+            if not self.follow and len(result["changes"]) < self.batch:
+                return
+
+
+# ==================== RETENTION ====================
+
+def compact(retention_days=None, max_records=None):
+    """Drop expired records; returns how many were removed"""
+    retention_days = RETENTION_DAYS if retention_days is None else retention_days
+    max_records = MAX_RECORDS if max_records is None else max_records
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat() if retention_days else ""
+    with sharding.file_lock(CHANGES_FILE + ".lock"):
+        if not os.path.exists(CHANGES_FILE):
+            return 0
+        # First pass: count records and the expired run at the start
+        total = expired = 0
+        with open(CHANGES_FILE, "rb") as f:
+            for line in f:
+                total += 1
+                if cutoff and expired == total - 1 and json.loads(line)["ts"] < cutoff:
+                    expired += 1
+        removed = max(expired, total - max_records if max_records else 0)
+        removed = min(removed, total - 1)
+        if removed <= 0:
+            return 0
+        # Second pass: copy what is kept
+        with open(CHANGES_FILE, "rb") as src, sharding.atomic_write(CHANGES_FILE, "wb") as dst:
+            for i, line in enumerate(src):
+                if i >= removed:
+                    dst.write(line)
+        return removed
+
+
+def forget_users(usernames):
+    """Clear the data of deleted accounts' changes; returns how many were redacted"""
+    def redact(line):
+        record = json.loads(line)
+        if record.get("username") not in usernames or not record.get("data"):
+            return None
+        record["data"] = {}
+        record["redacted"] = True
+        return (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+
+    with sharding.file_lock(CHANGES_FILE + ".lock"):
+        if not os.path.exists(CHANGES_FILE):
+            return 0
+        # First pass: only rewrite the log if something needs redacting
+        with open(CHANGES_FILE, "rb") as f:
+            if not any(redact(line) for line in f):
+                return 0
+        redacted = 0
+        with open(CHANGES_FILE, "rb") as src, sharding.atomic_write(CHANGES_FILE, "wb") as dst:
+            for line in src:
+                replacement = redact(line)
+                if replacement is not None:
+                    redacted += 1
+                    line = replacement
+                dst.write(line)
+        return redacted
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Change feed tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_tail = sub.add_parser("tail", help="print changes after a cursor")
+    p_tail.add_argument("--after", type=int, default=0)
+    p_tail.add_argument("--follow", action="store_true", help="keep waiting for new changes")
+    p_tail.add_argument("--cursor-file", help="resume from and save the cursor in this file")
+    p_compact = sub.add_parser("compact", help="apply retention now")
+    p_compact.add_argument("--days", type=float, default=None)
+    p_compact.add_argument("--max-records", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "compact":
+        print(f"[OK] Removed {compact(args.days, args.max_records)} expired changes")
+        return 0
+    if args.cursor_file:
+        cursor = ChangeCursor.resume(args.cursor_file, follow=args.follow)
+    else:
+        cursor = ChangeCursor(args.after, follow=args.follow)
+    try:
+        for change in cursor:
+            print(json.dumps(change, ensure_ascii=False))
+            cursor.save()
+    except KeyboardInterrupt:
+        pass
+    if cursor.reset:
+        print("Warning: some changes after the cursor were compacted away", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,135 @@
+"""
+coalesce.py - Single-flight request coalescing for per-user computations
+
+When several requests ask for the same expensive result at once (a user
+with the dashboard open in three tabs, or a front end polling /dashboard
+and /stats together), only the first one computes it. The rest wait for
+that call and share its result. A finished result can also be reused for
+COALESCE_TTL_SECONDS, so a burst that arrives just after it does not
+recompute either. Set the TTL to 0 to only share calls that overlap.
+
+Writes must call invalidate(username) so the next read sees the new data.
+A computation that was already running when the write happened still
+answers the callers waiting on it, but its result is not kept for reuse.
+
+Threaded servers call do(). Async servers await do_async(), which runs
+the computation in a worker thread and coalesces with threaded callers of
+the same key. Shared results must be treated as read-only.
+"""
+
+import os
+import time
+import asyncio
+import threading
+from collections import Counter, defaultdict
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_TTL = float(os.getenv("COALESCE_TTL_SECONDS", "2.0"))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "stale")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.stale = False
+
+
+class SingleFlight:
+    """Coalesce concurrent calls per key; keys are (kind, username) tuples"""
+
+    def __init__(self, ttl=None, max_results=10000):
+        self.ttl = DEFAULT_TTL if ttl is None else ttl
+        self.max_results = max_results
+        self._lock = threading.Lock()
+        self._calls = {}        # key -> _Call in flight
+        self._results = {}      # key -> (expires_at, result), oldest first
+        self.metrics = Counter()
+        self.by_kind = defaultdict(Counter)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), sharing it with concurrent callers of key"""
+        with self._lock:
+            self.metrics["calls"] += 1
+            self.by_kind[key[0]]["calls"] += 1
+            cached = self._results.get(key)
+            if cached is not None:
+                if cached[0] > time.monotonic():
+                    self.metrics["reused"] += 1
+                    self.by_kind[key[0]]["reused"] += 1
+                    return cached[1]
+                del self._results[key]
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.metrics["coalesced"] += 1
+                self.by_kind[key[0]]["coalesced"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        start = time.perf_counter()
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                self.metrics["executions"] += 1
+                self.by_kind[key[0]]["executions"] += 1
+                self.metrics["compute_ms"] += int((time.perf_counter() - start) * 1000)
+                if call.error is not None:
+                    self.metrics["errors"] += 1
+                elif self.ttl > 0 and not call.stale:
+                    self._store(key, call.result)
+            call.done.set()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _store(self, key, result):
+        now = time.monotonic()
+        if len(self._results) >= self.max_results:
+            for k in [k for k, (expires, _) in self._results.items() if expires <= now]:
+                del self._results[k]
+            while len(self._results) >= self.max_results:
+                del self._results[next(iter(self._results))]
+        self._results.pop(key, None)
+        self._results[key] = (now + self.ttl, result)
+
+    async def do_async(self, key, fn, *args, **kwargs):
+        """Awaitable do(): runs in a worker thread so the event loop never blocks"""
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.do(key, fn, *args, **kwargs))
+
+    def invalidate(self, username):
+        """Drop reusable results for a user after a write"""
+        with self._lock:
+            # Calls already running started before the write: detach them so
+            # new callers compute afresh instead of joining a stale result
+            for key in [k for k in self._calls if k[-1] == username]:
+                self._calls.pop(key).stale = True
+            for key in [k for k in self._results if k[-1] == username]:
+                del self._results[key]
+
+    def stats(self):
+        with self._lock:
+            m = dict(self.metrics)
+            m["in_flight"] = len(self._calls)
+            m["cached_results"] = len(self._results)
+            m["by_kind"] = {kind: dict(counts) for kind, counts in self.by_kind.items()}
+        calls = m.get("calls", 0)
+        m["ttl_seconds"] = self.ttl
+        m["saved_ratio"] = round((m.get("coalesced", 0) + m.get("reused", 0)) / calls, 3) if calls else 0.0
+        return m
@@ -0,0 +1,82 @@
+"""
+fake_llm.py - Local stand-in for an OpenAI-compatible chat completions API
+
+Serves POST /v1/chat/completions with canned replies, optionally streamed
+token by token with a configurable delay, so the LLM responder path can be
+exercised without network access or an API key:
+
+    python fake_llm.py --port 8808 --token-delay 0.05
+    CHAT_BACKEND=llm LLM_BASE_URL=http://127.0.0.1:8808/v1 python web_app.py
+"""
+
+import json
+import threading
+import time
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+REPLY = "I hear you. Take a slow breath with me, and let's look at what would help most right now."
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error(404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        cfg = self.server.config
+        time.sleep(cfg["first_token_delay"])
+        if not body.get("stream"):
+            payload = json.dumps({
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": cfg["reply"]}}]
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        words = cfg["reply"].split(" ")
+        for i, word in enumerate(words):
+            token = word if i == 0 else " " + word
+            chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(cfg["token_delay"])
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+def start_fake_llm(port=0, token_delay=0.02, first_token_delay=0.0, reply=REPLY):
+    """Start the fake server on a background thread; returns (server, base_url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), FakeLLMHandler)
+    server.daemon_threads = True
+    server.config = {"token_delay": token_delay, "first_token_delay": first_token_delay, "reply": reply}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible chat server")
+    parser.add_argument("--port", type=int, default=8808)
+    parser.add_argument("--token-delay", type=float, default=0.05)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    args = parser.parse_args()
+    server, url = start_fake_llm(args.port, args.token_delay, args.first_token_delay)
+    print(f"Fake LLM listening at {url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,361 @@
+"""
+loadtest.py - Local load generator for the web app
+
+Starts web_app.app on a free local port against a throwaway data directory
+and drives it with concurrent simulated users. Each user registers, logs in
+and then performs a weighted mix of journal, dashboard, stats, entries, chat
+and export requests. The report lists throughput plus p50/p95/p99 latency and
+error rate per route; pass several --backend names to compare storage
+backends under the same traffic.
+
+    python loadtest.py --users 50 --actions 40
+    python loadtest.py --users 20 --mix dashboard=5,chat=1 --backend json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import threading
+import importlib
+import urllib.error
+import urllib.parse
+import urllib.request
+from http.cookiejar import CookieJar
+from collections import defaultdict
+
+from werkzeug.serving import make_server
+
+import web_app
+import tombstones
+import sharding
+import reminders
+import achievements
+import changes
+import analytics
+import response_cache
+
+DEFAULT_MIX = {
+    "add_entry": 2,
+    "dashboard": 3,
+    "stats": 2,
+    "entries": 2,
+    "chat": 2,
+    "export": 1,
+}
+
+MOODS = ["Happy", "Sad", "Anxious", "Calm", "Energetic", "Neutral", "Excited", "Overwhelmed"]
+JOURNALS = [
+    "Had a calm morning and a good walk after lunch.",
+    "Work was stressful and I could not focus at all.",
+    "Felt lonely today but talking to a friend helped.",
+    "Slept badly, tired and a bit anxious about tomorrow.",
+    "Great day! Finished my project and celebrated with family.",
+]
+CHATS = ["hi", "i feel anxious", "can't sleep", "thanks", "what should i do", "I had a weird day"]
+
+
+# ==================== STORAGE BACKENDS ====================
+
+# Module globals naming a data file. A run repoints them at its throwaway
+# directory and run_load_test() puts them back afterwards.
+DATA_FILE_GLOBALS = (
+    (web_app, "USERS_FILE"),
+    (web_app, "ENTRIES_FILE"),
+    (web_app, "CHAT_HISTORY_FILE"),
+    (tombstones, "TOMBSTONES_FILE"),
+    (tombstones, "USERS_FILE"),
+    (tombstones, "ENTRIES_FILE"),
+    (tombstones, "CHAT_HISTORY_FILE"),
+    (tombstones, "ACHIEVEMENTS_FILE"),
+    (sharding, "SHARDS_FILE"),
+    (reminders, "REMINDER_PREFS_FILE"),
+    (reminders, "ACTIVITY_LOG_FILE"),
+    (reminders, "REMINDERS_SENT_FILE"),
+    (achievements, "ACHIEVEMENTS_FILE"),
+    (achievements, "ENTRIES_FILE"),
+    (analytics, "ENTRIES_FILE"),
+    (analytics, "ANALYTICS_CACHE_FILE"),
+    (changes, "CHANGES_FILE"),
+    (response_cache, "DEFAULT_CACHE_FILE"),
+)
+# Other globals a backend may change: the unsharded data directory and the
+# compaction paths web_app captured at import
+OTHER_GLOBALS = (
+    (sharding, "DATA_DIR"),
+    (web_app, "COMPACTION_FILES"),
+)
+
+
+def save_globals():
+    return [(module, name, getattr(module, name)) for module, name in DATA_FILE_GLOBALS + OTHER_GLOBALS]
+
+
+def restore_globals(saved):
+    for module, name, value in saved:
+        setattr(module, name, value)
+
+
+def setup_json_backend(data_dir):
+    """Point the app at plain JSON files inside data_dir"""
+    for module, name in DATA_FILE_GLOBALS:
+        path = getattr(module, name)
+        if path:  # an empty AI_CACHE_FILE keeps the cache in memory
+            setattr(module, name, os.path.join(data_dir, os.path.basename(path)))
+    sharding.DATA_DIR = data_dir
+    web_app.COMPACTION_FILES = dict(users_file=web_app.USERS_FILE,
+                                    entries_file=web_app.ENTRIES_FILE,
+                                    chat_history_file=web_app.CHAT_HISTORY_FILE,
+                                    achievements_file=achievements.ACHIEVEMENTS_FILE)
+
+
+def setup_sharded_backend(data_dir, shards=4):
+    """JSON files spread over several shard directories by consistent hashing"""
+    setup_json_backend(data_dir)
+    sharding.write_config([os.path.join(data_dir, f"shard{i}") for i in range(shards)])
+
+    def teardown():
+        os.remove(sharding.SHARDS_FILE)
+    return teardown
+
+
+BACKENDS = {
+    "json": setup_json_backend,
+    "sharded": setup_sharded_backend,
+}
+
+
+def resolve_backend(name):
+    """Look up a backend by name, or import one given as "module:function"."""
+    if name in BACKENDS:
+        return BACKENDS[name]
+    if ":" in name:
+        module_name, func_name = name.split(":", 1)
+        return getattr(importlib.import_module(module_name), func_name)
+    raise ValueError(f"Unknown backend: {name}")
+
+
+# ==================== SIMULATED USERS ====================
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Report redirects as responses so each route is timed on its own"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.latencies[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+
+class SimulatedUser:
+    def __init__(self, base_url, username, recorder, rng):
+        self.base_url = base_url
+        self.username = username
+        self.password = "loadtest-pw"
+        self.recorder = recorder
+        self.rng = rng
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(CookieJar()), _NoRedirect)
+
+    def request(self, route, path, form=None, json_body=None):
+        data, headers = None, {}
+        if form is not None:
+            data = urllib.parse.urlencode(form).encode("utf-8")
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        elif json_body is not None:
+            data = json.dumps(json_body).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.base_url + path, data=data, headers=headers)
+        location = ""
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=30) as resp:
+                resp.read()
+                status = resp.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+            location = e.headers.get("Location", "")
+        except Exception:
+            status = 0
+        elapsed = time.perf_counter() - start
+        # A redirect to /login means the session was lost, which is a failure
+        ok = 200 <= status < 400 and not location.endswith("/login")
+        self.recorder.record(route, elapsed, ok)
+        return status
+
+    def register(self):
+        self.request("register", "/register", form={
+            "username": self.username,
+            "password": self.password,
+            "confirm_password": self.password,
+        })
+
+    def login(self):
+        self.request("login", "/login", form={"username": self.username, "password": self.password})
+
+    def act(self, action):
+        if action == "add_entry":
+            self.request("add_entry", "/add-entry", form={
+                "mood": self.rng.choice(MOODS),
+                "journal": self.rng.choice(JOURNALS),
+                "exercise": self.rng.choice(["Walking", "Yoga", "Meditation", ""]),
+                "gratitude": "my friends",
+            })
+        elif action == "dashboard":
+            self.request("dashboard", "/dashboard")
+        elif action == "stats":
+            self.request("stats", "/stats")
+        elif action == "entries":
+            self.request("entries", "/entries")
+        elif action == "chat":
+            self.request("chat", "/api/chat", json_body={"message": self.rng.choice(CHATS)})
+        elif action == "export":
+            self.request("export", "/export")
+
+
+def run_user(base_url, index, mix, actions, recorder, think_time, seed):
+    rng = random.Random(seed + index)
+    user = SimulatedUser(base_url, f"load_user_{index}", recorder, rng)
+    user.register()
+    user.login()
+    names, weights = zip(*mix.items())
+    for action in rng.choices(names, weights=weights, k=actions):
+        user.act(action)
+        if think_time:
+            time.sleep(rng.uniform(0, think_time))
+
+
+# ==================== RUNNER & REPORT ====================
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    k = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[k]
+
+
+def run_load_test(backend="json", users=20, actions=30, mix=None, think_time=0.0, seed=0):
+    """Run one load test against a fresh data directory; returns a report dict"""
+    mix = mix or DEFAULT_MIX
+    recorder = Recorder()
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    saved = save_globals()
+    try:
+        with tempfile.TemporaryDirectory(prefix="loadtest-") as data_dir:
+            teardown = resolve_backend(backend)(data_dir)
+            server = make_server("127.0.0.1", 0, web_app.app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            base_url = f"http://127.0.0.1:{server.server_port}"
+            try:
+                threads = [
+                    threading.Thread(target=run_user, args=(base_url, i, mix, actions, recorder, think_time, seed))
+                    for i in range(users)
+                ]
+                start = time.perf_counter()
+                for t in threads:
+                    t.start()
+                for t in threads:
+                    t.join()
+                wall = time.perf_counter() - start
+            finally:
+                server.shutdown()
+                if callable(teardown):
+                    teardown()
+    finally:
+        # Later runs and the rest of the process see the real data files again
+        restore_globals(saved)
+
+    routes = {}
+    total = errors = 0
+    for route, values in sorted(recorder.latencies.items()):
+        values.sort()
+        total += len(values)
+        errors += recorder.errors[route]
+        routes[route] = {
+            "count": len(values),
+            "p50_ms": percentile(values, 50) * 1000,
+            "p95_ms": percentile(values, 95) * 1000,
+            "p99_ms": percentile(values, 99) * 1000,
+            "error_rate": recorder.errors[route] / len(values),
+        }
+    return {
+        "backend": backend,
+        "users": users,
+        "requests": total,
+        "seconds": wall,
+        "throughput_rps": total / wall if wall else 0.0,
+        "error_rate": errors / total if total else 0.0,
+        "routes": routes,
+    }
+
+
+def print_report(report):
+    print(f"\n=== Backend: {report['backend']} — {report['users']} users ===")
+    print(f"Requests: {report['requests']} in {report['seconds']:.2f}s "
+          f"({report['throughput_rps']:.1f} req/s), errors {report['error_rate']:.1%}")
+    print(f"{'route':<12}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}")
+    for route, r in report["routes"].items():
+        print(f"{route:<12}{r['count']:>8}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}"
+              f"{r['p99_ms']:>10.1f}{r['error_rate']:>9.1%}")
+
+
+def print_comparison(reports):
+    print("\n=== Comparison ===")
+    print(f"{'backend':<20}{'req/s':>10}{'errors':>9}{'worst p99 ms':>14}")
+    for report in reports:
+        worst = max((r["p99_ms"] for r in report["routes"].values()), default=0.0)
+        print(f"{report['backend']:<20}{report['throughput_rps']:>10.1f}{report['error_rate']:>9.1%}{worst:>14.1f}")
+
+
+def parse_mix(text):
+    mix = dict(DEFAULT_MIX)
+    if text:
+        mix = {}
+        for part in text.split(","):
+            name, _, weight = part.partition("=")
+            if name.strip() not in DEFAULT_MIX:
+                raise ValueError(f"Unknown action in mix: {name}")
+            mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the Mental Wellness web app")
+    parser.add_argument("--users", type=int, default=20, help="concurrent simulated users")
+    parser.add_argument("--actions", type=int, default=30, help="requests per user after login")
+    parser.add_argument("--mix", default="", help="weights, e.g. dashboard=3,chat=1,add_entry=2")
+    parser.add_argument("--think-time", type=float, default=0.0, help="max random pause between requests (s)")
+    parser.add_argument("--backend", action="append", help="storage backend name or module:function (repeatable)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_out", help="also write the reports to this file")
+    args = parser.parse_args(argv)
+
+    mix = parse_mix(args.mix)
+    reports = []
+    for backend in args.backend or ["json"]:
+        report = run_load_test(backend, args.users, args.actions, mix, args.think_time, args.seed)
+        print_report(report)
+        reports.append(report)
+    if len(reports) > 1:
+        print_comparison(reports)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=2)
+    return 0 if all(r["error_rate"] == 0 for r in reports) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,11 +11,25 @@ import os
 import json
 import time
 import sys
+import atexit
+import shutil
+import hashlib
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from datetime import date, datetime, timedelta
 from collections import Counter
-from textblob import TextBlob
 from dotenv import load_dotenv
 import openai
+import tombstones
+import sharding
+import profiling
+import reminders
+import sentiment
+import records
+import achievements
+import changes
+import responders
+from response_cache import ResponseCache, DEFAULT_CACHE_FILE
 
 # Fix Unicode output on Windows
 if sys.platform == 'win32':
@@ -41,35 +55,66 @@ ENTRIES_FILE = "entries.json"
 load_dotenv()
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
+AI_MODEL = "gpt-3.5-turbo"
 
-def load_users():
-    if os.path.exists(USERS_FILE):
-        try:
-            with open(USERS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
+# Companion replies are cached across runs; set AI_CACHE_FILE= to keep it in memory only
+_ai_cache = None
 
 
-def save_users(users):
-    with open(USERS_FILE, "w", encoding="utf-8") as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+def get_ai_cache():
+    """The reply cache, loaded on first use so imports and batch runs never write it"""
+    global _ai_cache
+    if _ai_cache is None:
+        _ai_cache = ResponseCache(path=DEFAULT_CACHE_FILE or None)
+        atexit.register(_ai_cache.save)
+    return _ai_cache
 
 
-def load_entries():
-    if os.path.exists(ENTRIES_FILE):
+def _read_json(path, default):
+    if os.path.exists(path):
         try:
-            with open(ENTRIES_FILE, "r", encoding="utf-8") as f:
+            with open(path, "r", encoding="utf-8") as f:
                 return json.load(f)
         except Exception:
-            return []
-    return []
+            # Keep the unreadable file, since the next save replaces it, and
+            # salvage the complete records of a cut-off array
+            try:
+                shutil.copyfile(path, path + ".corrupt")
+                if isinstance(default, list):
+                    return list(records.iter_records(path))
+            except OSError:
+                pass
+            return default
+    return default
+
+
+def load_users(username=None):
+    """Load users; given a username, only the shard holding that user is read"""
+    users = {}
+    for path, only in sharding.read_paths(USERS_FILE, username):
+        sharding.merge_users(users, _read_json(path, {}), only)
+    return tombstones.filter_users(users)
+
+
+def save_users(users, username=None):
+    sharding.write_json_atomic(sharding.write_path(USERS_FILE, username), users, indent=2)
+
 
+def load_entries(username=None):
+    """Load entries; given a username, only the shard holding that user is read"""
+    entries = []
+    for path, only in sharding.read_paths(ENTRIES_FILE, username):
+        sharding.merge_entries(entries, _read_json(path, []), only)
+    return tombstones.filter_entries(entries)
 
-def save_entries(entries):
-    with open(ENTRIES_FILE, "w", encoding="utf-8") as f:
-        json.dump(entries, f, ensure_ascii=False, indent=2)
+
+def save_entries(entries, username=None):
+    sharding.write_json_atomic(sharding.write_path(ENTRIES_FILE, username), entries, indent=2)
+
+
+def load_user_entries(username):
+    """Read-only view of one user's entries as compact Entry records"""
+    return records.load_user_entries(ENTRIES_FILE, username)
 
 
 AFFIRMATIONS = [
@@ -109,14 +154,8 @@ def calculate_weekly_stats(user_entries):
         "avg_sentiment": 0,
         "streak_days": 0,
     }
-    sentiments = []
-    for e in recent_entries:
-        text = e.get("journal", "")
-        if isinstance(text, str) and text.strip():
-            try:
-                sentiments.append(TextBlob(text).sentiment.polarity)
-            except Exception:
-                pass
+    texts = [e.get("journal") for e in recent_entries]
+    sentiments = sentiment.get_engine().score_many([t for t in texts if isinstance(t, str) and t.strip()])
     if sentiments:
         stats["avg_sentiment"] = sum(sentiments) / len(sentiments)
 
@@ -133,25 +172,34 @@ def calculate_weekly_stats(user_entries):
     return stats
 
 
-def ai_response(prompt_text):
+def ai_response(prompt_text, username=None):
+    """Ask the AI companion, serving the reply from the reply cache when possible"""
     text = (prompt_text or "").strip()
     if not text:
         return "I'm here and listening."
     if not openai.api_key:
         return "OpenAI API key not configured. Set OPENAI_API_KEY in environment to enable AI chat."
+    key = ResponseCache.make_key(text, responders.SYSTEM_PROMPT, AI_MODEL, username=username)
+    ai_cache = get_ai_cache()
+    cached = ai_cache.get(key)
+    if cached is not None:
+        return cached
+    messages = [
+        {"role": "system", "content": responders.SYSTEM_PROMPT},
+        {"role": "user", "content": text},
+    ]
     try:
         resp = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a gentle, supportive mental wellness companion. Respond concisely, kindly, and practically."},
-                {"role": "user", "content": text},
-            ],
+            model=AI_MODEL,
+            messages=messages,
             max_tokens=180,
             temperature=0.7,
         )
-        return resp.choices[0].message.content.strip()
+        reply = resp.choices[0].message.content.strip()
     except Exception as e:
         return f"AI is unavailable right now. Error: {e}"
+    ai_cache.put(key, reply)
+    return reply
 
 
 def generate_pdf_report(user_entries, username, out_path=None):
@@ -228,8 +276,14 @@ def create_account(users):
     if not password:
         print("Password cannot be empty")
         return None
+    if tombstones.is_deleted(username):
+        # Reclaim the old account's data before the name is reused
+        tombstones.compact(users_file=USERS_FILE, entries_file=ENTRIES_FILE, usernames=[username])
+    with sharding.lock_for(username):
+        shard_users = load_users(username)
+        shard_users[username] = password
+        save_users(shard_users, username)
     users[username] = password
-    save_users(users)
     print("🎉 Account created. You can now log in.")
     return username
 
@@ -246,15 +300,24 @@ def add_entry(username):
         "exercise": exercise,
         "unusual_breathing": False,
     }
-    entries = load_entries()
-    entries.append(entry)
-    save_entries(entries)
+    with sharding.lock_for(username):
+        entries = load_entries(username)
+        entries.append(entry)
+        save_entries(entries, username)
+        unlocked = achievements.on_insert(username, entry)
+        changes.record("entry.created", username, entry)
+    reminders.record_activity(username)
     print("[OK] Entry saved.")
+    announce_achievements(unlocked)
+
+
+def announce_achievements(unlocked):
+    for a in unlocked:
+        print(f"{a['icon']} Achievement unlocked: {a['name']} - {a['desc']}")
 
 
 def list_entries(username):
-    entries = load_entries()
-    my = [e for e in entries if e.get("username") == username]
+    my = load_user_entries(username)
     if not my:
         print("No entries found.")
         return
@@ -266,8 +329,7 @@ def list_entries(username):
 
 
 def show_weekly_stats(username):
-    entries = load_entries()
-    my = [e for e in entries if e.get("username") == username]
+    my = load_user_entries(username)
     stats = calculate_weekly_stats(my)
     if not stats:
         print("No entries in the past 7 days.")
@@ -298,34 +360,38 @@ def exercises_menu(username):
         return
     save = input("Save this as an exercise entry? (y/N): ").lower()
     if save == "y":
-        entries = load_entries()
-        entries.append({
+        entry = {
             "username": username,
             "date": date.today().strftime("%Y-%m-%d"),
             "mood": "",
             "journal": f"Completed exercise: {choice}",
             "exercise": "Breathing" if choice == "1" else "Grounding" if choice == "2" else "Affirmation",
             "unusual_breathing": False,
-        })
-        save_entries(entries)
+        }
+        with sharding.lock_for(username):
+            entries = load_entries(username)
+            entries.append(entry)
+            save_entries(entries, username)
+            unlocked = achievements.on_insert(username, entry)
+            changes.record("entry.created", username, entry)
+        reminders.record_activity(username)
         print("[OK] Exercise saved.")
+        announce_achievements(unlocked)
 
 
 def export_json(username):
-    entries = load_entries()
-    my = [e for e in entries if e.get("username") == username]
+    my = load_user_entries(username)
     if not my:
         print("No entries to export.")
         return
     filename = f"wellness_data_{username}_{date.today().strftime('%Y%m%d')}.json"
     with open(filename, "w", encoding="utf-8") as f:
-        json.dump(my, f, ensure_ascii=False, indent=2)
+        json.dump([e.to_dict() for e in my], f, ensure_ascii=False, indent=2)
     print(f"[OK] Exported to {filename}")
 
 
 def export_pdf(username):
-    entries = load_entries()
-    my = [e for e in entries if e.get("username") == username]
+    my = load_user_entries(username)
     if not my:
         print("No entries to export.")
         return
@@ -342,85 +408,244 @@ def delete_account(username):
     if confirm != "DELETE":
         print("Aborted.")
         return False
-    users = load_users()
-    if username in users:
-        del users[username]
-        save_users(users)
-    entries = load_entries()
-    remaining = [e for e in entries if e.get("username") != username]
-    save_entries(remaining)
+    # Tombstone now; the data is reclaimed once enough deletions pile up
+    tombstones.add_tombstone(username)
+    changes.record("account.deleted", username)
+    if _ai_cache is not None:
+        # Otherwise the save at exit would write the replies back
+        _ai_cache.forget_users([username])
+    tombstones.maybe_compact(users_file=USERS_FILE, entries_file=ENTRIES_FILE)
     print("Account and entries deleted.")
     return True
 
 
+# ==================== BATCH MODE ====================
+
+BATCH_STATE_FILE = "batch_state.json"
+
+
+def _limit_worker_memory(max_memory_mb):
+    """Process-pool initializer: cap each worker's address space (Unix only)"""
+    if not max_memory_mb:
+        return
+    try:
+        import resource
+        limit = int(max_memory_mb) * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except Exception:
+        pass
+
+
+def _entries_fingerprint(user_entries):
+    digest = hashlib.sha1()
+    for e in user_entries:
+        digest.update(json.dumps(e.to_dict(), sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def build_user_report(username, user_entries, out_dir, formats):
+    """Weekly stats plus JSON/PDF exports for one user (runs in a worker)"""
+    start = time.perf_counter()
+    stamp = date.today().strftime("%Y%m%d")
+    stats = calculate_weekly_stats(user_entries)
+    files = []
+    if "json" in formats:
+        path = os.path.join(out_dir, f"wellness_data_{username}_{stamp}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump([e.to_dict() for e in user_entries], f, ensure_ascii=False, indent=2)
+        files.append(path)
+    if "pdf" in formats and REPORTLAB_AVAILABLE:
+        files.append(generate_pdf_report(user_entries, username,
+                                         out_path=os.path.join(out_dir, f"wellness_report_{username}_{stamp}.pdf")))
+    if stats:
+        stats = dict(stats, moods=dict(stats["moods"]))
+    return {"username": username, "stats": stats, "files": files, "seconds": time.perf_counter() - start}
+
+
+def run_batch(out_dir, workers=None, formats=("json", "pdf"), incremental=False,
+              max_in_flight=None, max_memory_mb=None):
+    """Produce weekly stats and reports for every user in one pass.
+
+    Storage is read once, one shard at a time; during a rebalance, users
+    being moved are read afterwards across both their shards so each entry
+    counts once. Users are spread over a
+    process pool with at most `max_in_flight` users queued at once, so the
+    parent never holds more than one shard plus that many pending
+    payloads. With `incremental`, users whose entries are unchanged since the
+    previous run are skipped.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    state_path = os.path.join(out_dir, BATCH_STATE_FILE)
+    previous = _read_json(state_path, {}) if incremental else {}
+    state = dict(previous)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    results = []
+    skipped = 0
+    started = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_limit_worker_memory,
+                             initargs=(max_memory_mb,)) as pool:
+        pending = {}
+
+        def drain(block_until):
+            while len(pending) > block_until:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    username, fingerprint = pending.pop(future)
+                    try:
+                        results.append(future.result())
+                        state[username] = fingerprint
+                    except Exception as e:
+                        results.append({"username": username, "error": str(e), "seconds": 0.0})
+
+        def submit(username, user_entries):
+            nonlocal skipped
+            fingerprint = _entries_fingerprint(user_entries)
+            if incremental and previous.get(username) == fingerprint:
+                skipped += 1
+                return
+            future = pool.submit(build_user_report, username, user_entries, out_dir, tuple(formats))
+            pending[future] = (username, fingerprint)
+            drain(max_in_flight)
+
+        # Mid-rebalance a moving user's entries can be on two shards; those
+        # users are read once across both after the shard pass
+        moving = {} if sharding.rebalancing() else None
+        for path, _ in sharding.read_paths(ENTRIES_FILE):
+            by_user = {}
+            dead = tombstones.deleted_usernames()
+            for e in records.iter_entries(path):
+                if e.username and e.username not in dead:
+                    if moving is not None:
+                        if e.username not in moving:
+                            moving[e.username] = sharding.moving(e.username)
+                        if moving[e.username]:
+                            continue
+                    by_user.setdefault(e.username, []).append(e)
+            for username, user_entries in by_user.items():
+                submit(username, user_entries)
+            del by_user
+        for username in sorted(u for u, is_moving in (moving or {}).items() if is_moving):
+            user_entries = records.load_user_entries(ENTRIES_FILE, username)
+            if user_entries:
+                submit(username, user_entries)
+        drain(0)
+
+    sharding.write_json_atomic(state_path, state, indent=2)
+    summary = {
+        "generated": datetime.now().isoformat(),
+        "users_processed": len(results),
+        "users_skipped": skipped,
+        "seconds": time.perf_counter() - started,
+        "users": sorted(results, key=lambda r: r["seconds"], reverse=True),
+    }
+    with open(os.path.join(out_dir, "batch_summary.json"), "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, indent=2)
+    return summary
+
+
+def batch_main(argv):
+    parser = argparse.ArgumentParser(prog="mental_bot.py batch",
+                                     description="Generate weekly digests for every user")
+    parser.add_argument("--out", default="reports", help="output directory")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--formats", default="json,pdf", help="comma-separated: json,pdf")
+    parser.add_argument("--since-last-run", action="store_true", help="only users whose entries changed")
+    parser.add_argument("--max-in-flight", type=int, default=None, help="users queued to workers at once")
+    parser.add_argument("--max-memory-mb", type=int, default=None, help="per-worker memory cap (Unix)")
+    args = parser.parse_args(argv)
+
+    formats = tuple(f.strip() for f in args.formats.split(",") if f.strip())
+    if "pdf" in formats and not REPORTLAB_AVAILABLE:
+        print("reportlab not available; skipping PDF reports.")
+    summary = run_batch(args.out, args.workers, formats, args.since_last_run,
+                        args.max_in_flight, args.max_memory_mb)
+    print(f"[OK] {summary['users_processed']} users processed, {summary['users_skipped']} unchanged, "
+          f"in {summary['seconds']:.2f}s")
+    for r in summary["users"][:10]:
+        status = f"ERROR {r['error']}" if "error" in r else f"{r['seconds'] * 1000:.1f} ms"
+        print(f" - {r['username']}: {status}")
+    return 1 if any("error" in r for r in summary["users"]) else 0
+
+
 def main_loop():
     users = load_users()
     current_user = None
     while True:
         print_menu()
         choice = input("Choose an option: ").strip()
-        if choice == "1":
-            if current_user:
-                print(f"Already logged in as {current_user}")
-            else:
-                u = prompt_login(users)
+        capture = profiling.start_cli_profile(choice) if choice != "0" else None
+        try:
+            if choice == "1":
+                if current_user:
+                    print(f"Already logged in as {current_user}")
+                else:
+                    u = prompt_login(users)
+                    if u:
+                        current_user = u
+            elif choice == "2":
+                u = create_account(users)
                 if u:
-                    current_user = u
-        elif choice == "2":
-            u = create_account(users)
-            if u:
-                current_user = None
-        elif choice == "3":
-            if not current_user:
-                print("Please log in first.")
-            else:
-                add_entry(current_user)
-        elif choice == "4":
-            if not current_user:
-                print("Please log in first.")
-            else:
-                list_entries(current_user)
-        elif choice == "5":
-            if not current_user:
-                print("Please log in first.")
-            else:
-                show_weekly_stats(current_user)
-        elif choice == "6":
-            if not current_user:
-                print("Please log in first.")
-            else:
-                exercises_menu(current_user)
-        elif choice == "7":
-            if not current_user:
-                print("Please log in first.")
-            else:
-                prompt = input("Say something to your AI companion: \n")
-                print("AI: ", ai_response(prompt))
-        elif choice == "8":
-            if not current_user:
-                print("Please log in first.")
-            else:
-                export_json(current_user)
-        elif choice == "9":
-            if not current_user:
-                print("Please log in first.")
-            else:
-                export_pdf(current_user)
-        elif choice == "10":
-            if not current_user:
-                print("Please log in first.")
-            else:
-                deleted = delete_account(current_user)
-                if deleted:
                     current_user = None
-        elif choice == "0":
-            print("Goodbye — take care.")
-            break
-        else:
-            print("Invalid choice. Please try again.")
+            elif choice == "3":
+                if not current_user:
+                    print("Please log in first.")
+                else:
+                    add_entry(current_user)
+            elif choice == "4":
+                if not current_user:
+                    print("Please log in first.")
+                else:
+                    list_entries(current_user)
+            elif choice == "5":
+                if not current_user:
+                    print("Please log in first.")
+                else:
+                    show_weekly_stats(current_user)
+            elif choice == "6":
+                if not current_user:
+                    print("Please log in first.")
+                else:
+                    exercises_menu(current_user)
+            elif choice == "7":
+                if not current_user:
+                    print("Please log in first.")
+                else:
+                    prompt = input("Say something to your AI companion: \n")
+                    print("AI: ", ai_response(prompt, username=current_user))
+            elif choice == "8":
+                if not current_user:
+                    print("Please log in first.")
+                else:
+                    export_json(current_user)
+            elif choice == "9":
+                if not current_user:
+                    print("Please log in first.")
+                else:
+                    export_pdf(current_user)
+            elif choice == "10":
+                if not current_user:
+                    print("Please log in first.")
+                else:
+                    deleted = delete_account(current_user)
+                    if deleted:
+                        users.pop(current_user, None)
+                        current_user = None
+            elif choice == "0":
+                print("Goodbye — take care.")
+                break
+            else:
+                print("Invalid choice. Please try again.")
+        except sharding.LockTimeout:
+            print("Your data is busy right now (maintenance is running). Please try again in a moment.")
+        if capture:
+            capture.finish()
 
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        sys.exit(batch_main(sys.argv[2:]))
     print("Starting Mental Wellness Companion (text mode)")
     main_loop()
 
@@ -0,0 +1,272 @@
+"""
+profiling.py - Opt-in sampling profiler for web requests and CLI commands
+
+A background thread samples the stack of the thread handling a request (or
+a CLI menu command) at a fixed interval and writes the result in collapsed
+stack format ("frame;frame;frame count"), which flamegraph.pl, speedscope
+and inferno read directly. Samples are wall-clock, so time spent waiting on
+disk or input() shows up too.
+
+Profiling a Flask request is enabled either by configuration
+(PROFILE_ENDPOINTS=dashboard,stats or "*") or per request with a signed
+query flag, ?_profile=<signature>, where the signature comes from
+`python profiling.py sign /dashboard` and PROFILE_SECRET. The CLI is
+profiled when PROFILE_CLI=1. Sampling rate, samples per capture, captures
+per minute and concurrent captures are all capped to bound the overhead.
+
+    python profiling.py summarize profiles/ --top 25
+    python profiling.py merge profiles/ > all.collapsed
+"""
+
+import os
+import sys
+import hmac
+import glob
+import time
+import hashlib
+import argparse
+import threading
+from collections import Counter, deque
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_ENDPOINTS = {e.strip() for e in os.getenv("PROFILE_ENDPOINTS", "").split(",") if e.strip()}
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_CLI = os.getenv("PROFILE_CLI", "") == "1"
+QUERY_FLAG = "_profile"
+
+# Never sample faster than MIN_INTERVAL, whatever is configured
+MIN_INTERVAL = 0.001
+SAMPLE_INTERVAL = max(MIN_INTERVAL, float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0)
+MAX_SAMPLES = int(os.getenv("PROFILE_MAX_SAMPLES", "20000"))
+MAX_PER_MINUTE = int(os.getenv("PROFILE_MAX_PER_MINUTE", "10"))
+MAX_CONCURRENT = int(os.getenv("PROFILE_MAX_CONCURRENT", "2"))
+
+
+def frame_label(code):
+    """Flamegraph frame name, e.g. "dashboard (web_app.py:412)"."""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Samples one thread's call stack until stopped"""
+
+    def __init__(self, thread_id=None, interval=SAMPLE_INTERVAL, max_samples=MAX_SAMPLES):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = max(MIN_INTERVAL, interval)
+        self.max_samples = max_samples
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            in_profiler = False
+            while frame is not None:
+                in_profiler = in_profiler or frame.f_code.co_filename == __file__
+                stack.append(frame_label(frame.f_code))
+                frame = frame.f_back
+            # Skip samples taken while the target is starting or stopping us
+            if in_profiler:
+                continue
+            self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+            if self.samples >= self.max_samples:
+                break
+
+    def write_collapsed(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+
+class _Budget:
+    """Caps how many captures may start per minute and run at once"""
+
+    def __init__(self, per_minute=MAX_PER_MINUTE, concurrent=MAX_CONCURRENT):
+        self.per_minute = per_minute
+        self.concurrent = concurrent
+        self._starts = deque()
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._starts and now - self._starts[0] > 60:
+                self._starts.popleft()
+            if len(self._starts) >= self.per_minute or self._running >= self.concurrent:
+                return False
+            self._starts.append(now)
+            self._running += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._running -= 1
+
+
+budget = _Budget()
+
+
+class Capture:
+    """One budgeted profiling session that saves itself when finished"""
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = SamplingProfiler().start()
+
+    def finish(self):
+        self.profiler.stop()
+        budget.release()
+        if not self.profiler.samples:
+            return None
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        safe_name = "".join(c if c.isalnum() or c in "-_" else "_" for c in self.name)
+        return self.profiler.write_collapsed(os.path.join(PROFILE_DIR, f"{stamp}-{safe_name}.collapsed"))
+
+
+def start_capture(name):
+    """Start a capture if the overhead budget allows; returns None otherwise"""
+    if not budget.acquire():
+        return None
+    return Capture(name)
+
+
+# ==================== FLASK & CLI HOOKS ====================
+
+def sign_path(path, secret=None):
+    secret = PROFILE_SECRET if secret is None else secret
+    return hmac.new(secret.encode("utf-8"), path.encode("utf-8"), hashlib.sha256).hexdigest()[:32]
+
+
+def _signed_request(request):
+    signature = request.args.get(QUERY_FLAG)
+    if not signature or not PROFILE_SECRET:
+        return False
+    return hmac.compare_digest(signature, sign_path(request.path))
+
+
+def init_app(app):
+    """Register request hooks that profile configured or signed requests"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_profile():
+        endpoint = request.endpoint or ""
+        if "*" in PROFILE_ENDPOINTS or endpoint in PROFILE_ENDPOINTS or _signed_request(request):
+            g.profile_capture = start_capture(f"web-{endpoint}")
+
+    @app.teardown_request
+    def _finish_profile(exc):
+        capture = g.pop("profile_capture", None)
+        if capture is not None:
+            capture.finish()
+
+    return app
+
+
+def start_cli_profile(command):
+    """Start profiling one CLI menu command when PROFILE_CLI=1"""
+    if not PROFILE_CLI:
+        return None
+    return start_capture(f"cli-{command}")
+
+
+# ==================== VIEWER ====================
+
+def read_collapsed(paths):
+    stacks = Counter()
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack and count.isdigit():
+                    stacks[stack] += int(count)
+    return stacks
+
+
+def summarize(stacks, top=20):
+    """Return (total, [(frame, self_samples, total_samples)]) ordered by self time"""
+    self_counts = Counter()
+    total_counts = Counter()
+    total = 0
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        total += count
+        self_counts[frames[-1]] += count
+        for frame in set(frames):
+            total_counts[frame] += count
+    rows = [(frame, n, total_counts[frame]) for frame, n in self_counts.most_common(top)]
+    return total, rows
+
+
+def _profile_files(target):
+    if os.path.isdir(target):
+        return sorted(glob.glob(os.path.join(target, "*.collapsed")))
+    return [target] if os.path.exists(target) else []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collapsed-stack profile tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_sum = sub.add_parser("summarize", help="top functions across captured profiles")
+    p_sum.add_argument("target", nargs="?", default=PROFILE_DIR)
+    p_sum.add_argument("--top", type=int, default=20)
+    p_merge = sub.add_parser("merge", help="merge profiles into one collapsed file on stdout")
+    p_merge.add_argument("target", nargs="?", default=PROFILE_DIR)
+    p_sign = sub.add_parser("sign", help="print the ?_profile= value for a request path")
+    p_sign.add_argument("path")
+    args = parser.parse_args(argv)
+
+    if args.command == "sign":
+        if not PROFILE_SECRET:
+            print("PROFILE_SECRET is not set.")
+            return 1
+        print(f"{args.path}?{QUERY_FLAG}={sign_path(args.path)}")
+        return 0
+
+    files = _profile_files(args.target)
+    if not files:
+        print("No profiles found.")
+        return 1
+    stacks = read_collapsed(files)
+    if args.command == "merge":
+        for stack, count in stacks.most_common():
+            print(f"{stack} {count}")
+        return 0
+
+    total, rows = summarize(stacks, args.top)
+    print(f"{len(files)} profile(s), {total} samples")
+    print(f"{'self %':>8}{'total %':>9}  function")
+    for frame, self_n, total_n in rows:
+        print(f"{100.0 * self_n / total:>7.1f}%{100.0 * total_n / total:>8.1f}%  {frame}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+records.py - Compact entry records and a streaming entries reader
+
+Entry is a slotted record for one journal entry, shared by the web app and
+the CLI. It has fixed fields for the keys both apps write; app-specific
+keys (gratitude, mood_color, unusual_breathing) are stored as a values
+tuple next to a key tuple that all entries with the same keys share.
+Usernames, moods, exercises, mood colours and CLI dates repeat across
+thousands of entries, so they are interned and all entries share one copy
+of each string. Entry supports get(), [] and `in` exactly like the dicts
+it replaces, including keys stored as null, so stats code and templates
+can use either one.
+
+iter_records() reads an entries file one record at a time. It accepts a
+JSON array (the format the apps write) or JSON Lines. Memory use depends
+on the size of a single record, not the size of the file. A file cut off
+mid-write still yields every complete record before the cut.
+
+    python records.py entries.json      # count records and compare memory use
+"""
+
+import os
+import re
+import sys
+import json
+import logging
+
+import sharding
+import tombstones
+
+CHUNK_SIZE = 64 * 1024
+
+_decoder = json.JSONDecoder()
+_SEPARATORS = re.compile(r"[\s,]*")
+_INTERNED = frozenset(("username", "mood", "exercise", "mood_color"))
+_key_tuples = {}
+
+logger = logging.getLogger("records")
+
+
+def _intern(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Entry:
+    """One journal entry; fields the record did not have read as None"""
+
+    __slots__ = ("username", "date", "mood", "journal", "exercise", "sentiment", "absent", "extra_keys",
+                 "extra_values")
+
+    FIELDS = ("username", "date", "mood", "journal", "exercise", "sentiment")
+
+    def __init__(self, username=None, date=None, mood=None, journal=None, exercise=None, sentiment=None,
+                 extra=None, absent=None):
+        self.username = _intern(username)
+        # CLI dates ("YYYY-MM-DD") repeat across entries; web timestamps do not
+        self.date = _intern(date) if type(date) is str and len(date) == 10 else date
+        self.mood = _intern(mood)
+        self.journal = journal
+        self.exercise = _intern(exercise)
+        self.sentiment = sentiment
+        # Fixed fields the record did not have, as opposed to ones stored as
+        # null; unless told otherwise, every field passed as None
+        if absent is None:
+            absent = tuple(key for key in self.FIELDS if getattr(self, key) is None)
+        self.absent = _key_tuples.setdefault(absent, absent) if absent else ()
+        # Other keys are kept as a keys tuple shared by every entry with the
+        # same layout plus a values tuple, which is much smaller than a dict
+        if extra:
+            keys = tuple(extra)
+            self.extra_keys = _key_tuples.setdefault(keys, keys)
+            self.extra_values = tuple(_intern(v) if k in _INTERNED else v for k, v in extra.items())
+        else:
+            self.extra_keys = self.extra_values = ()
+
+    @classmethod
+    def from_dict(cls, data):
+        extra = None
+        for key, value in data.items():
+            if key not in cls.FIELDS:
+                if extra is None:
+                    extra = {}
+                extra[key] = value
+        absent = tuple(key for key in cls.FIELDS if key not in data)
+        return cls(data.get("username"), data.get("date"), data.get("mood"), data.get("journal"),
+                   data.get("exercise"), data.get("sentiment"), extra, absent)
+
+    @property
+    def extra(self):
+        return dict(zip(self.extra_keys, self.extra_values))
+
+    def to_dict(self):
+        """Plain dict for JSON output, with the same keys and values as the record read"""
+        data = {key: getattr(self, key) for key in self.FIELDS if key not in self.absent}
+        data.update(zip(self.extra_keys, self.extra_values))
+        return data
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return default if key in self.absent else getattr(self, key)
+        if key in self.extra_keys:
+            return self.extra_values[self.extra_keys.index(key)]
+        return default
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return self.get(key)
+
+    def __contains__(self, key):
+        if key in self.FIELDS:
+            return key not in self.absent
+        return key in self.extra_keys
+
+    def __eq__(self, other):
+        return isinstance(other, Entry) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f"Entry({self.username!r}, {self.date!r}, {self.mood!r})"
+
+
+# ==================== STREAMING READER ====================
+
+def iter_records(path, chunk_size=CHUNK_SIZE):
+    """Yield the records of a JSON array or JSON Lines file one at a time"""
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        head = f.read(chunk_size)
+        stripped = head.lstrip()
+        # Leading whitespace can fill whole chunks; only an empty read is EOF
+        while head and not stripped:
+            head = f.read(chunk_size)
+            stripped = head.lstrip()
+        if not stripped:
+            return
+        if stripped[0] != "[":
+            f.seek(0)
+            for number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("%s: skipping unreadable line %d", path, number)
+                    continue
+                yield record
+            return
+
+        buf = stripped
+        pos = 1
+        eof = False
+        while True:
+            pos = _SEPARATORS.match(buf, pos).end()
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            if pos < len(buf):
+                try:
+                    record, end = _decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        logger.warning("%s: truncated JSON array; read the records before the cut", path)
+                        return
+                    end = None
+                # A record ending exactly at the buffer edge may be cut short
+                if end is not None and (end < len(buf) or eof):
+                    yield record
+                    pos = end
+                    continue
+            elif eof:
+                logger.warning("%s: unterminated JSON array", path)
+                return
+            # Keep the unparsed tail and read more; at least double it so a
+            # record larger than one chunk is not re-parsed once per chunk
+            chunk = f.read(max(chunk_size, len(buf) - pos))
+            eof = not chunk
+            buf = buf[pos:] + chunk
+            pos = 0
+
+
+def iter_entries(path, username=None, chunk_size=CHUNK_SIZE):
+    """Stream Entry records from one file, optionally only one user's"""
+    for record in iter_records(path, chunk_size):
+        if isinstance(record, dict) and (username is None or record.get("username") == username):
+            yield Entry.from_dict(record)
+
+
+def iter_all_records(path, chunk_size=CHUNK_SIZE):
+    """Yield the records of a data file from every shard, each record once.
+
+    Mid-rebalance a moving user's records can be on their old and their new
+    shard at once; those are deduplicated as in load_user_entries().
+    """
+    paths = sharding.read_paths(path)
+    dedupe = len(paths) > 1 and sharding.rebalancing()
+    moving = {}
+    seen = set()
+    for shard_path, _ in paths:
+        for record in iter_records(shard_path, chunk_size):
+            if dedupe and isinstance(record, dict):
+                name = record.get("username")
+                if name not in moving:
+                    moving[name] = sharding.moving(name)
+                if moving[name]:
+                    key = json.dumps(record, sort_keys=True, ensure_ascii=False)
+                    if key in seen:
+                        continue
+                    seen.add(key)
+            yield record
+
+
+def iter_all_entries(path, chunk_size=CHUNK_SIZE):
+    """Stream Entry records from every shard of an entries file, each entry once"""
+    for record in iter_all_records(path, chunk_size):
+        if isinstance(record, dict):
+            yield Entry.from_dict(record)
+
+
+def load_user_entries(entries_file, username):
+    """One user's entries from whichever shards hold them, without loading whole files"""
+    if tombstones.is_deleted(username):
+        return []
+    paths = sharding.read_paths(entries_file, username)
+    if len(paths) == 1:
+        return list(iter_entries(paths[0][0], username))
+    # Mid-rebalance the same entry can be on two shards
+    entries = []
+    seen = set()
+    for path, _ in paths:
+        for entry in iter_entries(path, username):
+            key = json.dumps(entry.to_dict(), sort_keys=True, ensure_ascii=False)
+            if key not in seen:
+                seen.add(key)
+                entries.append(entry)
+    return entries
+
+
+def _deep_size(obj, seen):
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, list):
+        size += sum(_deep_size(item, seen) for item in obj)
+    elif isinstance(obj, tuple):
+        size += sum(_deep_size(item, seen) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(_deep_size(k, seen) + _deep_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, Entry):
+        size += sum(_deep_size(getattr(obj, s), seen) for s in Entry.__slots__)
+    return size
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else "entries.json"
+    dicts = list(iter_records(path))
+    entries = [Entry.from_dict(d) for d in dicts if isinstance(d, dict)]
+    if not entries:
+        print(f"No entries in {path}")
+        return 0
+    # Journal text costs the same either way, so it is reported separately
+    text_bytes = sum(sys.getsizeof(e.journal) for e in entries if e.journal is not None)
+    dict_bytes = _deep_size(dicts, set()) - text_bytes
+    entry_bytes = _deep_size(entries, set()) - text_bytes
+    print(f"{len(entries)} entries in {path} ({text_bytes / len(entries):,.0f} bytes/entry of journal text)")
+    print(f"dicts:   {dict_bytes / len(entries):,.0f} bytes/entry overhead")
+    print(f"Entry:   {entry_bytes / len(entries):,.0f} bytes/entry overhead")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,440 @@
+"""
+reminders.py - Daily check-in reminder scheduler
+
+Each user may choose a local reminder time and time zone (REMINDER_PREFS_FILE).
+The scheduler keeps one heap item per user, keyed by the next reminder time,
+and sleeps until the earliest one is due, so a run with no due reminders uses
+no CPU. When a reminder comes due, users who already checked in that local
+day are skipped. The check uses an append-only activity log of last-entry
+times written by the apps, not a scan of entries.json.
+
+Before a reminder is handed to a sink, one line is appended to
+REMINDERS_SENT_FILE. A restarted scheduler therefore never sends the same
+user's reminder twice for the same day. Delivery is at-most-once: a crash
+mid-delivery drops that reminder rather than repeating it. On start the
+sent log is shrunk back to one line per user.
+
+Deleted accounts are never reminded, and tombstone compaction removes
+their preferences.
+
+    python reminders.py set prajna 20:30 Europe/London
+    python reminders.py run --sink log
+    python reminders.py run --sink webhook --url http://127.0.0.1:9000/remind
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import logging
+import argparse
+import threading
+import urllib.request
+from datetime import datetime, timedelta, timezone
+
+try:
+    from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+except ImportError:  # Python < 3.9
+    ZoneInfo = ZoneInfoNotFoundError = None
+
+from dotenv import load_dotenv
+
+import sharding
+import tombstones
+
+load_dotenv()
+
+REMINDER_PREFS_FILE = os.getenv("REMINDER_PREFS_FILE", "reminder_prefs.json")
+ACTIVITY_LOG_FILE = os.getenv("ACTIVITY_LOG_FILE", "activity.log")
+REMINDERS_SENT_FILE = os.getenv("REMINDERS_SENT_FILE", "reminders_sent.jsonl")
+DEFAULT_TIME = "20:00"
+DEFAULT_TZ = "UTC"
+
+# Upper bound on how long the scheduler sleeps before re-reading preferences
+PREFS_POLL_SECONDS = 60.0
+# After a restart, reminders that fell due this recently are still sent
+CATCH_UP_SECONDS = float(os.getenv("REMINDER_CATCH_UP_SECONDS", "3600"))
+
+logger = logging.getLogger("reminders")
+
+
+def _tz(name):
+    if not name or name == "UTC" or ZoneInfo is None:
+        return timezone.utc
+    try:
+        return ZoneInfo(name)
+    except Exception:
+        return timezone.utc
+
+
+def _parse_time(value):
+    hour, minute = (int(part) for part in (value or DEFAULT_TIME).split(":", 1))
+    if not (0 <= hour < 24 and 0 <= minute < 60):
+        raise ValueError(f"invalid reminder time: {value}")
+    return hour, minute
+
+
+# ==================== PREFERENCES & ACTIVITY ====================
+
+def load_preferences():
+    if os.path.exists(REMINDER_PREFS_FILE):
+        try:
+            with open(REMINDER_PREFS_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+    return {}
+
+
+def _prefs_lock():
+    return sharding.file_lock(REMINDER_PREFS_FILE + ".lock")
+
+
+def set_preference(username, at=DEFAULT_TIME, tz=DEFAULT_TZ, enabled=True):
+    """Store a user's reminder time ("HH:MM") and IANA time zone.
+
+    Raises ValueError for an invalid time or an unknown time zone.
+    """
+    if not isinstance(at, str) or not isinstance(tz, str):
+        raise ValueError("reminder time and time zone must be strings")
+    _parse_time(at)
+    if tz != DEFAULT_TZ and ZoneInfo is not None:
+        try:
+            ZoneInfo(tz)
+        except (ZoneInfoNotFoundError, ValueError) as e:
+            raise ValueError(f"unknown time zone: {tz}") from e
+    pref = {"time": at, "tz": tz, "enabled": bool(enabled)}
+    with _prefs_lock():
+        prefs = load_preferences()
+        prefs[username] = pref
+        sharding.write_json_atomic(REMINDER_PREFS_FILE, prefs, indent=2)
+    return pref
+
+
+def forget_users(usernames):
+    """Drop deleted accounts' preferences; returns how many were removed"""
+    with _prefs_lock():
+        prefs = load_preferences()
+        kept = {u: p for u, p in prefs.items() if u not in usernames}
+        if len(kept) != len(prefs):
+            sharding.write_json_atomic(REMINDER_PREFS_FILE, kept, indent=2)
+    return len(prefs) - len(kept)
+
+
+def _activity_lock(path):
+    """Cross-process lock shared by appends to and compactions of an activity log"""
+    return sharding.file_lock(path + ".lock")
+
+
+def record_activity(username, when=None):
+    """Note that a user checked in; one appended line, no file rewrite"""
+    when = when or datetime.now(timezone.utc)
+    line = json.dumps({"u": username, "t": when.timestamp()}, ensure_ascii=False)
+    with _activity_lock(ACTIVITY_LOG_FILE):
+        with open(ACTIVITY_LOG_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class ActivityIndex:
+    """Last check-in time per user, kept current by tailing the activity log"""
+
+    def __init__(self, path=None):
+        self.path = path or ACTIVITY_LOG_FILE
+        self.last_seen = {}
+        self._offset = 0
+        self._file_id = None
+
+    def refresh(self):
+        try:
+            f = open(self.path, "rb")
+        except OSError:
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            file_id = (st.st_dev, st.st_ino)
+            if file_id != self._file_id or st.st_size < self._offset:
+                # A compaction or rotation replaced the file, even if the new
+                # one is no smaller; read it again from the start
+                self._file_id = file_id
+                self._offset = 0
+            if st.st_size == self._offset:
+                return
+            f.seek(self._offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # partial line still being written
+                self._offset += len(raw)
+                try:
+                    record = json.loads(raw)
+                except Exception:
+                    continue
+                if record["t"] > self.last_seen.get(record["u"], 0):
+                    self.last_seen[record["u"]] = record["t"]
+
+    def active_on(self, username, local_day, tz):
+        ts = self.last_seen.get(username)
+        if ts is None:
+            return False
+        return datetime.fromtimestamp(ts, tz).date() == local_day
+
+
+def compact_activity_log(path=None):
+    """Rewrite the activity log keeping only each user's latest check-in"""
+    index = ActivityIndex(path)
+    # Appends wait meanwhile, so none is lost between the read and the replace
+    with _activity_lock(index.path):
+        index.refresh()
+        with sharding.atomic_write(index.path) as f:
+            for username, ts in index.last_seen.items():
+                f.write(json.dumps({"u": username, "t": ts}, ensure_ascii=False) + "\n")
+    return len(index.last_seen)
+
+
+# ==================== SINKS ====================
+
+class LogSink:
+    """Deliver reminders to the `reminders` logger"""
+
+    def send(self, username, local_day, message):
+        logger.info("Reminder for %s (%s): %s", username, local_day, message)
+
+
+class PrintSink:
+    """Deliver reminders to stdout, for running alongside the CLI"""
+
+    def send(self, username, local_day, message):
+        print(f"[REMINDER] {username}: {message}")
+
+
+class WebhookSink:
+    """POST each reminder as JSON to a URL"""
+
+    def __init__(self, url, timeout=5.0):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, username, local_day, message):
+        body = json.dumps({"username": username, "date": local_day.isoformat(), "message": message}).encode("utf-8")
+        req = urllib.request.Request(self.url, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+            resp.read()
+
+
+# ==================== SCHEDULER ====================
+
+REMINDER_MESSAGE = "Time for your daily check-in. How are you feeling today?"
+
+
+class ReminderScheduler:
+    """Heap-based scheduler that wakes only when the next reminder is due"""
+
+    def __init__(self, sink, clock=time.time, activity=None, sent_path=None, message=REMINDER_MESSAGE):
+        self.sink = sink
+        self.clock = clock
+        self.activity = activity or ActivityIndex()
+        self.sent_path = sent_path or REMINDERS_SENT_FILE
+        self.message = message
+        self.prefs = {}
+        self.sent = {}  # username -> last local day a reminder was sent
+        self.stats = {"sent": 0, "skipped_active": 0, "skipped_sent": 0, "skipped_deleted": 0, "failed": 0}
+        self._heap = []
+        self._version = {}
+        self._prefs_key = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._load_sent()
+
+    def _load_sent(self):
+        """Read the sent log, then rewrite it with only each user's latest day"""
+        if not os.path.exists(self.sent_path):
+            return
+        lines = 0
+        with open(self.sent_path, "r", encoding="utf-8") as f:
+            for line in f:
+                lines += 1
+                try:
+                    record = json.loads(line)
+                except Exception:
+                    continue
+                if record["d"] > self.sent.get(record["u"], ""):
+                    self.sent[record["u"]] = record["d"]
+        if lines > len(self.sent):
+            with sharding.atomic_write(self.sent_path) as f:
+                for username, day in self.sent.items():
+                    f.write(json.dumps({"u": username, "d": day}, ensure_ascii=False) + "\n")
+
+    def _mark_sent(self, batch):
+        """Durably record (username, local_day) pairs before delivering them"""
+        with open(self.sent_path, "a", encoding="utf-8") as f:
+            for username, local_day in batch:
+                f.write(json.dumps({"u": username, "d": local_day.isoformat()}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        for username, local_day in batch:
+            self.sent[username] = local_day.isoformat()
+
+    def _next_due(self, pref, after):
+        """First reminder instant strictly after `after` (a UTC timestamp)"""
+        tz = _tz(pref.get("tz"))
+        hour, minute = _parse_time(pref.get("time"))
+        local_day = datetime.fromtimestamp(after, tz).date()
+        for offset in range(0, 3):
+            day = local_day + timedelta(days=offset)
+            due = datetime(day.year, day.month, day.day, hour, minute, tzinfo=tz).timestamp()
+            if due > after:
+                return due
+        return after + 86400
+
+    def schedule(self, username, pref, now=None):
+        """(Re)schedule one user; older heap items for them become stale"""
+        now = self.clock() if now is None else now
+        self.prefs[username] = pref
+        version = self._version.get(username, 0) + 1
+        self._version[username] = version
+        if pref.get("enabled", True):
+            # Reminders missed while the scheduler was down are caught up;
+            # the sent log stops any that already went out from repeating
+            heapq.heappush(self._heap, (self._next_due(pref, now - CATCH_UP_SECONDS), username, version))
+        self._wake.set()
+
+    def unschedule(self, username):
+        self.prefs.pop(username, None)
+        self._version[username] = self._version.get(username, 0) + 1
+
+    def reload_preferences(self):
+        """Pick up changes to REMINDER_PREFS_FILE (only when it changed)"""
+        try:
+            st = os.stat(REMINDER_PREFS_FILE)
+            key = (st.st_mtime_ns, st.st_size)
+        except OSError:
+            key = None
+        if key == self._prefs_key:
+            return
+        self._prefs_key = key
+        dead = tombstones.deleted_usernames()
+        prefs = {u: p for u, p in load_preferences().items() if u not in dead}
+        now = self.clock()
+        for username in list(self.prefs):
+            if username not in prefs:
+                self.unschedule(username)
+        for username, pref in prefs.items():
+            if self.prefs.get(username) != pref:
+                self.schedule(username, pref, now)
+
+    def _should_send(self, username, due):
+        if tombstones.is_deleted(username):
+            self.stats["skipped_deleted"] += 1
+            return None
+        pref = self.prefs[username]
+        tz = _tz(pref.get("tz"))
+        local_day = datetime.fromtimestamp(due, tz).date()
+        if self.sent.get(username, "") >= local_day.isoformat():
+            self.stats["skipped_sent"] += 1
+            return None
+        if self.activity.active_on(username, local_day, tz):
+            self.stats["skipped_active"] += 1
+            return None
+        return local_day
+
+    def run_pending(self):
+        """Fire every reminder that is due; returns seconds until the next one"""
+        now = self.clock()
+        due_now = []
+        while self._heap:
+            due, username, version = self._heap[0]
+            if version != self._version.get(username):
+                heapq.heappop(self._heap)
+                continue
+            if due > now:
+                break
+            heapq.heappop(self._heap)
+            due_now.append((due, username))
+            heapq.heappush(self._heap, (self._next_due(self.prefs[username], due), username, version))
+
+        if due_now:
+            self.activity.refresh()
+            batch = []
+            for due, username in due_now:
+                local_day = self._should_send(username, due)
+                if local_day is not None:
+                    batch.append((username, local_day))
+            if batch:
+                # One fsync per wake-up, not per reminder
+                self._mark_sent(batch)
+            for username, local_day in batch:
+                try:
+                    self.sink.send(username, local_day, self.message)
+                    self.stats["sent"] += 1
+                except Exception as e:
+                    self.stats["failed"] += 1
+                    logger.warning("Reminder for %s failed: %s", username, e)
+
+        while self._heap and self._heap[0][2] != self._version.get(self._heap[0][1]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] - now if self._heap else None
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            self.reload_preferences()
+            wait = self.run_pending()
+            timeout = PREFS_POLL_SECONDS if wait is None else min(wait, PREFS_POLL_SECONDS)
+            self._wake.clear()
+            self._wake.wait(timeout)
+
+    def start(self):
+        thread = threading.Thread(target=self.run_forever, name="reminder-scheduler", daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+def build_sink(kind, url=None):
+    if kind == "webhook":
+        if not url:
+            raise ValueError("--url is required for the webhook sink")
+        return WebhookSink(url)
+    if kind == "print":
+        return PrintSink()
+    return LogSink()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Daily check-in reminders")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_set = sub.add_parser("set", help="set a user's reminder time and time zone")
+    p_set.add_argument("username")
+    p_set.add_argument("time", help="local time, HH:MM")
+    p_set.add_argument("tz", nargs="?", default=DEFAULT_TZ, help="IANA time zone, e.g. Europe/London")
+    p_off = sub.add_parser("off", help="disable a user's reminders")
+    p_off.add_argument("username")
+    p_run = sub.add_parser("run", help="run the scheduler")
+    p_run.add_argument("--sink", choices=["log", "print", "webhook"], default="log")
+    p_run.add_argument("--url")
+    sub.add_parser("compact-activity", help="shrink the activity log to one line per user")
+    args = parser.parse_args(argv)
+
+    if args.command == "set":
+        pref = set_preference(args.username, args.time, args.tz)
+        print(f"[OK] {args.username} will be reminded at {pref['time']} ({pref['tz']})")
+    elif args.command == "off":
+        pref = load_preferences().get(args.username, {})
+        set_preference(args.username, pref.get("time", DEFAULT_TIME), pref.get("tz", DEFAULT_TZ), enabled=False)
+        print(f"[OK] Reminders disabled for {args.username}")
+    elif args.command == "compact-activity":
+        print(f"[OK] Activity log now holds {compact_activity_log()} users")
+    else:
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+        scheduler = ReminderScheduler(build_sink(args.sink, args.url))
+        try:
+            scheduler.run_forever()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
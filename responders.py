@@ -0,0 +1,329 @@
+"""
+responders.py - Pluggable chat responder backends
+
+Two backends share one small interface: the built-in pattern matcher and an
+OpenAI-compatible LLM client. ChatService runs the LLM on a bounded worker
+pool with global and per-user concurrency limits and falls back to the
+pattern responder when a call is refused, fails or times out, so a slow model
+never leaves a request waiting indefinitely.
+"""
+
+import os
+import abc
+import json
+import queue
+import random
+import threading
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SYSTEM_PROMPT = "You are a gentle, supportive mental wellness companion. Respond concisely, kindly, and practically."
+
+RESPONSE_PATTERNS = {
+    'greeting': {
+        'patterns': ['hi', 'hello', 'hey', 'greetings'],
+        'responses': [
+            "Hello! I'm here to support your mental wellness journey. How can I help you today?",
+            "Hi there! It's great to see you. What's on your mind?",
+            "Hey! Welcome to your wellness space. How are you feeling today?"
+        ]
+    },
+    'mood': {
+        'patterns': ['how are you', 'how do you feel', 'how are things'],
+        'responses': [
+            "I'm here to listen and support you. How have you been feeling lately?",
+            "I appreciate you asking! More importantly, how are YOU doing?",
+            "I'm doing well, thank you for asking! Tell me about your day."
+        ]
+    },
+    'anxiety': {
+        'patterns': ['anxious', 'anxiety', 'nervous', 'worried', 'stress', 'stressed'],
+        'responses': [
+            "I hear you. Anxiety can be overwhelming. Try the breathing exercise - it helps many people. Would you like to try it?",
+            "It's normal to feel anxious sometimes. Remember, this feeling is temporary. Would a guided breathing exercise help?",
+            "Anxiety is your mind trying to protect you. Let's work through this together. Try some deep breathing: inhale for 4, hold for 4, exhale for 4."
+        ]
+    },
+    'sad': {
+        'patterns': ['sad', 'depressed', 'down', 'lonely', 'alone', 'unhappy'],
+        'responses': [
+            "I'm sorry you're feeling down. It's okay to feel sad sometimes. Talking about it is a good first step.",
+            "Sadness is a natural emotion. Remember, difficult emotions don't last forever. You're stronger than you think.",
+            "It takes courage to acknowledge your feelings. Would journaling help you process what you're feeling?"
+        ]
+    },
+    'gratitude': {
+        'patterns': ['thank', 'thanks', 'grateful', 'appreciate'],
+        'responses': [
+            "You're welcome! I'm grateful to be part of your wellness journey.",
+            "Happy to help! Remember, gratitude is a powerful tool for mental health.",
+            "That's wonderful! Expressing gratitude is great for your well-being."
+        ]
+    },
+    'exercise': {
+        'patterns': ['exercise', 'workout', 'fitness', 'breathing', 'meditation'],
+        'responses': [
+            "Great! Exercise is excellent for mental health. Try our breathing exercise or quick workout routine.",
+            "Movement and mindfulness are wonderful for wellness. Would you like to try our guided breathing or meditation?",
+            "That's a fantastic idea! Physical activity boosts mood and reduces stress. Let's get started!"
+        ]
+    },
+    'sleep': {
+        'patterns': ['sleep', 'tired', 'exhausted', 'can\'t sleep', 'insomnia'],
+        'responses': [
+            "Sleep is crucial for mental health. Try our meditation exercise before bed - it can help you relax.",
+            "Lack of sleep affects mood. Try limiting screens before bed and our breathing exercise to wind down.",
+            "Feeling tired? Rest is important. Consider a short meditation or breathing exercise to help you relax."
+        ]
+    },
+    'positive': {
+        'patterns': ['great', 'good', 'excellent', 'amazing', 'wonderful', 'happy'],
+        'responses': [
+            "That's wonderful to hear! Keep up this positive momentum!",
+            "I'm so happy for you! Celebrate these moments - you deserve it!",
+            "That's fantastic! Your positive energy is inspiring. Keep going!"
+        ]
+    },
+    'help': {
+        'patterns': ['help', 'advice', 'what should', 'what can i do'],
+        'responses': [
+            "I'm here to help! You can journal your feelings, try our exercises, track your mood, or just talk to me.",
+            "There are several things we can do: practice breathing exercises, meditation, journaling, or I can chat with you.",
+            "Let's work through this together. Try one of our wellness exercises or tell me what's bothering you."
+        ]
+    },
+    'journal': {
+        'patterns': ['journal', 'write', 'entry', 'entries'],
+        'responses': [
+            "Journaling is a powerful way to process emotions. It helps you gain clarity and track your progress.",
+            "Writing down your thoughts can be therapeutic. Go ahead and create a new journal entry!",
+            "Great idea! Journaling helps you understand yourself better and track your mental wellness journey."
+        ]
+    }
+}
+
+DEFAULT_RESPONSES = [
+    "That's interesting! Tell me more about what you're experiencing.",
+    "I understand. How does that make you feel?",
+    "Thank you for sharing. Is there something specific you'd like help with?",
+    "I'm listening. Would you like to try one of our wellness exercises?",
+    "That's valuable insight. What can I help you with today?"
+]
+
+
+class Responder(abc.ABC):
+    """Base class: turn a user message into a reply"""
+
+    @abc.abstractmethod
+    def respond(self, message, username=None):
+        """Return the whole reply to message"""
+
+    def stream(self, message, username=None):
+        """Yield the reply in chunks; backends without streaming yield it whole"""
+        yield self.respond(message, username)
+
+
+class PatternResponder(Responder):
+    """Keyword matching against canned supportive replies (no network)"""
+
+    def __init__(self, patterns=None, defaults=None):
+        self.patterns = RESPONSE_PATTERNS if patterns is None else patterns
+        self.defaults = DEFAULT_RESPONSES if defaults is None else defaults
+
+    def respond(self, message, username=None):
+        message_lower = (message or "").lower().strip()
+        for category, data in self.patterns.items():
+            for pattern in data['patterns']:
+                if pattern in message_lower:
+                    return random.choice(data['responses'])
+        return random.choice(self.defaults)
+
+
+class LLMResponder(Responder):
+    """Client for an OpenAI-compatible /chat/completions endpoint"""
+
+    def __init__(self, base_url=None, api_key=None, model=None, system_prompt=SYSTEM_PROMPT,
+                 max_tokens=180, temperature=0.7, timeout=30):
+        self.base_url = (base_url or os.getenv("LLM_BASE_URL", "https://api.openai.com/v1")).rstrip("/")
+        self.api_key = api_key if api_key is not None else os.getenv("OPENAI_API_KEY", "")
+        self.model = model or os.getenv("LLM_MODEL", "gpt-3.5-turbo")
+        self.system_prompt = system_prompt
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.timeout = timeout
+
+    def _open(self, message, stream):
+        body = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": message},
+            ],
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "stream": stream,
+        }
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        req = urllib.request.Request(self.base_url + "/chat/completions",
+                                     data=json.dumps(body).encode("utf-8"), headers=headers)
+        return urllib.request.urlopen(req, timeout=self.timeout)
+
+    def respond(self, message, username=None):
+        with self._open(message, stream=False) as resp:
+            data = json.load(resp)
+        return data["choices"][0]["message"]["content"].strip()
+
+    def stream(self, message, username=None):
+        with self._open(message, stream=True) as resp:
+            for raw in resp:
+                line = raw.decode("utf-8").strip()
+                if not line.startswith("data:"):
+                    continue
+                payload = line[5:].strip()
+                if payload == "[DONE]":
+                    break
+                delta = json.loads(payload)["choices"][0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+
+class ChatService:
+    """Runs a primary responder on a bounded pool with a cheap fallback.
+
+    At most `max_concurrency` primary calls run at once, and at most
+    `max_per_user` for any one user; a call over either limit is answered by
+    the fallback straight away instead of queueing. A call that does not
+    produce a reply (or, when streaming, its first token) within `timeout`
+    seconds is also answered by the fallback.
+    """
+
+    def __init__(self, primary, fallback=None, max_concurrency=8, max_per_user=1, timeout=8.0):
+        self.primary = primary
+        self.fallback = fallback or PatternResponder()
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.timeout = timeout
+        self.metrics = Counter()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="responder")
+        self._lock = threading.Lock()
+        self._active = 0
+        self._active_per_user = Counter()
+
+    def _acquire(self, username):
+        with self._lock:
+            if self._active >= self.max_concurrency:
+                self.metrics["rejected_global"] += 1
+                return False
+            if self._active_per_user[username] >= self.max_per_user:
+                self.metrics["rejected_user"] += 1
+                return False
+            self._active += 1
+            self._active_per_user[username] += 1
+            return True
+
+    def _release(self, username):
+        with self._lock:
+            self._active -= 1
+            self._active_per_user[username] -= 1
+            if self._active_per_user[username] <= 0:
+                del self._active_per_user[username]
+
+    def _fallback(self, message, username, reason):
+        self.metrics["fallback_" + reason] += 1
+        return self.fallback.respond(message, username)
+
+    def respond(self, message, username=None):
+        """Return the whole reply, waiting up to `timeout` seconds for the primary.
+
+        The calling thread blocks for that long; callers that can send the
+        reply incrementally should use stream() instead.
+        """
+        if self.primary is self.fallback:
+            return self.fallback.respond(message, username)
+        if not self._acquire(username):
+            return self._fallback(message, username, "busy")
+        future = self._executor.submit(self.primary.respond, message, username)
+        # The slot is held until the call really finishes, even if we stop waiting
+        future.add_done_callback(lambda f: self._release(username))
+        try:
+            reply = future.result(timeout=self.timeout)
+        except FutureTimeout:
+            return self._fallback(message, username, "timeout")
+        except Exception:
+            return self._fallback(message, username, "error")
+        self.metrics["primary"] += 1
+        return reply
+
+    def stream(self, message, username=None):
+        """Yield reply chunks as the primary produces them"""
+        if self.primary is self.fallback:
+            yield self.fallback.respond(message, username)
+            return
+        if not self._acquire(username):
+            yield self._fallback(message, username, "busy")
+            return
+
+        chunks = queue.Queue()
+        cancelled = threading.Event()
+        done = object()
+
+        def produce():
+            try:
+                for chunk in self.primary.stream(message, username):
+                    if cancelled.is_set():
+                        break
+                    chunks.put(chunk)
+            except Exception as e:
+                chunks.put(e)
+            finally:
+                chunks.put(done)
+                self._release(username)
+
+        self._executor.submit(produce)
+        deadline = time.monotonic() + self.timeout
+        produced = False
+        try:
+            while True:
+                try:
+                    chunk = chunks.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    if not produced:
+                        yield self._fallback(message, username, "timeout")
+                    else:
+                        self.metrics["truncated"] += 1
+                    return
+                if chunk is done:
+                    break
+                if isinstance(chunk, Exception):
+                    if not produced:
+                        yield self._fallback(message, username, "error")
+                    return
+                # Once tokens flow, allow the full timeout between chunks
+                produced = True
+                deadline = time.monotonic() + self.timeout
+                yield chunk
+        finally:
+            cancelled.set()
+        self.metrics["primary"] += 1
+
+
+def build_chat_service(fallback=None):
+    """Create the ChatService selected by CHAT_BACKEND ("pattern" or "llm")"""
+    fallback = fallback or PatternResponder()
+    if os.getenv("CHAT_BACKEND", "pattern").lower() != "llm":
+        return ChatService(fallback, fallback)
+    return ChatService(
+        LLMResponder(timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "8"))),
+        fallback,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        max_per_user=int(os.getenv("LLM_MAX_PER_USER", "1")),
+        timeout=float(os.getenv("LLM_TIMEOUT_SECONDS", "8")),
+    )
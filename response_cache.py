@@ -0,0 +1,202 @@
+"""
+response_cache.py - LRU/TTL cache for AI companion replies
+
+Many companion prompts are near-identical ("hi", "i feel anxious", "can't
+sleep"), so replies are cached under a key built from the normalized prompt,
+the system prompt and the model. Entries expire after a TTL, the least
+recently used entry is evicted once the cache is full, and the cache can be
+persisted to disk so it survives between CLI runs.
+
+Only short prompts are shared between users. Anything longer may carry
+personal detail, so it is cached per user, and not cached at all when no
+username is known. Keys keep their scope readable, which lets a deleted
+account's replies be dropped (forget_users).
+"""
+
+import os
+import re
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+
+from dotenv import load_dotenv
+
+import sharding
+
+load_dotenv()
+
+DEFAULT_MAX_SIZE = int(os.getenv("AI_CACHE_SIZE", "512"))
+DEFAULT_TTL = float(os.getenv("AI_CACHE_TTL_SECONDS", str(24 * 3600)))
+DEFAULT_CACHE_FILE = os.getenv("AI_CACHE_FILE", "ai_response_cache.json")
+
+# Prompts up to this many words may be shared between users
+SHARED_MAX_WORDS = 8
+# Separates a key's scope from the hash of the prompt
+_SCOPE_SEP = "\x1f"
+
+_PUNCT = re.compile(r"[^\w\s']+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_prompt(text):
+    """Lowercase, drop punctuation and collapse whitespace"""
+    text = _PUNCT.sub(" ", (text or "").lower())
+    return _SPACES.sub(" ", text).strip()
+
+
+def cache_scope(normalized, username=None):
+    """Return the key scope for a prompt, or None if it must not be cached"""
+    if len(normalized.split()) <= SHARED_MAX_WORDS:
+        return "*"
+    if username:
+        return "user:" + username
+    return None
+
+
+def key_scope(key):
+    """The scope a key was made for, or None for keys that do not record one"""
+    scope, sep, _ = key.rpartition(_SCOPE_SEP)
+    return scope if sep else None
+
+
+def forget_users(usernames, path=None):
+    """Drop these users' replies from the cache file; returns how many were removed"""
+    path = DEFAULT_CACHE_FILE if path is None else path
+    scopes = {"user:" + name for name in usernames}
+    if not path or not scopes or not os.path.exists(path):
+        return 0
+    with sharding.file_lock(path + ".lock"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception:
+            return 0
+        entries = saved.get("entries", [])
+        kept = [e for e in entries if key_scope(e[0]) not in scopes]
+        removed = len(entries) - len(kept)
+        if removed:
+            saved["entries"] = kept
+            sharding.write_json_atomic(path, saved)
+    return removed
+
+
+class ResponseCache:
+    """Thread-safe LRU cache with per-entry expiry and hit-rate metrics"""
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=DEFAULT_TTL, path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.metrics = Counter()
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        if path:
+            self.load()
+
+    @staticmethod
+    def make_key(prompt, system_prompt="", model="", username=None):
+        normalized = normalize_prompt(prompt)
+        scope = cache_scope(normalized, username)
+        if scope is None:
+            return None
+        raw = "\x1f".join([model, system_prompt, normalized])
+        return scope + _SCOPE_SEP + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.metrics["misses"] += 1
+                return None
+            value, expires_at = item
+            if expires_at <= time.time():
+                del self._data[key]
+                self.metrics["expired"] += 1
+                self.metrics["misses"] += 1
+                return None
+            self._data.move_to_end(key)
+            self.metrics["hits"] += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        if key is None:
+            return
+        with self._lock:
+            self._data[key] = (value, time.time() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.metrics["evictions"] += 1
+
+    def forget_users(self, usernames):
+        """Drop the per-user replies of these users; returns how many were removed"""
+        scopes = {"user:" + name for name in usernames}
+        with self._lock:
+            stale = [key for key in self._data if key_scope(key) in scopes]
+            for key in stale:
+                del self._data[key]
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.metrics["hits"] + self.metrics["misses"]
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "hits": self.metrics["hits"],
+                "misses": self.metrics["misses"],
+                "evictions": self.metrics["evictions"],
+                "expired": self.metrics["expired"],
+                "hit_rate": self.metrics["hits"] / lookups if lookups else 0.0,
+            }
+
+    def load(self):
+        """Load unexpired entries and cumulative metrics from self.path"""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except Exception:
+            return
+        now = time.time()
+        with self._lock:
+            for key, value, expires_at in saved.get("entries", []):
+                # Keys saved before they recorded a scope cannot be forgotten per user
+                if expires_at > now and key_scope(key) is not None:
+                    self._data[key] = (value, expires_at)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+            self.metrics.update(saved.get("metrics", {}))
+
+    def save(self):
+        """Write entries (oldest first, so LRU order survives) to self.path"""
+        if not self.path:
+            return
+        with self._lock:
+            saved = {
+                "entries": [[k, v, exp] for k, (v, exp) in self._data.items()],
+                "metrics": dict(self.metrics),
+            }
+        with sharding.file_lock(self.path + ".lock"):
+            sharding.write_json_atomic(self.path, saved)
+
+
+if __name__ == "__main__":
+    cache = ResponseCache(path=DEFAULT_CACHE_FILE)
+    s = cache.stats()
+    print(f"Cache file: {DEFAULT_CACHE_FILE}")
+    print(f"Entries: {s['size']}/{s['max_size']}")
+    print(f"Hits: {s['hits']}  Misses: {s['misses']}  Hit rate: {s['hit_rate']:.1%}")
+    print(f"Evictions: {s['evictions']}  Expired: {s['expired']}")
@@ -0,0 +1,261 @@
+"""
+sentiment.py - Pluggable sentiment engines with a batch API
+
+Two engines share one interface. TextBlobEngine scores through TextBlob
+(one TextBlob per text). LexiconEngine is a built-in scorer over a
+precomputed word list (sentiment_lexicon.json) and needs no third-party
+packages. It handles negation ("not good"), intensifiers ("very good"),
+negation carried across short words ("not a good day") and "!" emphasis,
+following the rules of TextBlob's pattern analyzer, so scores match
+TextBlob's except that emoticons are not scored. Both engines score a
+whole list of texts with score_many().
+
+SENTIMENT_ENGINE selects the engine ("textblob" or "lexicon"). The default
+is textblob. Lexicon is used when TextBlob is not installed, and, with a
+logged warning, when the setting names an unknown engine.
+
+    python sentiment.py bench --corpus entries.json --n 5000
+    python sentiment.py build-lexicon     # regenerate the lexicon from TextBlob's data
+"""
+
+import os
+import abc
+import re
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LEXICON_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sentiment_lexicon.json")
+NEGATIONS = frozenset(("no", "not", "n't", "never"))
+_TOKEN = re.compile(r"[a-z]+(?=n't)|n't|[a-z]+(?:'[a-z]+)?|!")
+
+logger = logging.getLogger("sentiment")
+
+
+class SentimentEngine(abc.ABC):
+    """Base class: polarity in [-1.0, 1.0] for one text or many"""
+
+    name = "base"
+
+    @abc.abstractmethod
+    def score(self, text):
+        """Polarity of one text"""
+
+    def score_many(self, texts):
+        return [self.score(t) for t in texts]
+
+
+class TextBlobEngine(SentimentEngine):
+    name = "textblob"
+
+    def __init__(self):
+        from textblob import TextBlob
+        self._TextBlob = TextBlob
+
+    def score(self, text):
+        if not text:
+            return 0.0
+        try:
+            return self._TextBlob(text).sentiment.polarity
+        except Exception:
+            return 0.0
+
+
+class LexiconEngine(SentimentEngine):
+    """Word-list scorer; about an order of magnitude faster than TextBlob"""
+
+    name = "lexicon"
+
+    def __init__(self, path=None):
+        with open(path or LEXICON_FILE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # word -> (polarity, intensity)
+        self.words = {w: (p, i) for w, (p, i) in data["words"].items()}
+        self.modifiers = frozenset(data["modifiers"])
+
+    def score(self, text):
+        if not text:
+            return 0.0
+        words = self.words
+        modifiers = self.modifiers
+        chunks = []  # [polarity, intensity, negated]
+        modifier = None  # preceding known adverb, e.g. "very"
+        negation = False
+        for w in _TOKEN.findall(text.lower()):
+            known = words.get(w)
+            if known is not None:
+                p, i = known
+                if modifier and chunks:
+                    # "very good": scale by the modifier's intensity
+                    last = chunks[-1]
+                    last[0] = max(-1.0, min(p * last[1], 1.0))
+                    last[1] = i
+                else:
+                    chunks.append([p, i, False])
+                if negation:
+                    chunks[-1][1] = 1.0 / chunks[-1][1] if chunks[-1][1] else 1.0
+                    chunks[-1][2] = True
+                modifier = w if w in modifiers else None
+                negation = w in NEGATIONS
+                continue
+            if w in NEGATIONS:
+                negation = True
+            elif negation and len(w.strip("'")) > 1:
+                negation = False
+            if negation and modifier and modifier.endswith("ly"):
+                # "really not good"
+                chunks[-1][2] = True
+                negation = False
+            elif modifier and len(w) > 2:
+                modifier = None
+            if w == "!" and chunks:
+                chunks[-1][0] = max(-1.0, min(chunks[-1][0] * 1.25, 1.0))
+        if not chunks:
+            return 0.0
+        return sum(p * -0.5 if negated else p for p, _, negated in chunks) / len(chunks)
+
+
+ENGINES = {
+    "textblob": TextBlobEngine,
+    "lexicon": LexiconEngine,
+}
+
+_engines = {}
+
+
+def get_engine(name=None):
+    """Shared engine instance for SENTIMENT_ENGINE (or the given name)"""
+    name = (name or os.getenv("SENTIMENT_ENGINE", "textblob")).lower()
+    engine = _engines.get(name)
+    if engine is None:
+        if name not in ENGINES:
+            # Cached under the bad name too, so this is logged once, not per entry
+            logger.warning("Unknown SENTIMENT_ENGINE %r; using the lexicon engine", name)
+            engine = get_engine("lexicon")
+        else:
+            try:
+                engine = ENGINES[name]()
+            except ImportError:
+                engine = get_engine("lexicon")
+        _engines[name] = engine
+    return engine
+
+
+# ==================== LEXICON BUILD ====================
+
+def build_lexicon(out_path=None):
+    """Dump TextBlob's loaded sentiment table (one averaged entry per word)"""
+    from textblob.en import sentiment as table
+
+    table.load()
+    # The None key holds TextBlob's average over every part of speech, and also
+    # covers the "-ly" adverbs it derives from adjectives at load time
+    words = {w: [round(by_pos[None][0], 6), round(by_pos[None][2], 6)]
+             for w, by_pos in sorted(dict.items(table)) if None in by_pos}
+    modifiers = sorted(w for w, by_pos in dict.items(table) if any(m in by_pos for m in table.modifiers))
+    out_path = out_path or LEXICON_FILE
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"source": "TextBlob en-sentiment.xml (PDDL)", "words": words,
+                   "modifiers": modifiers}, f, ensure_ascii=False, separators=(",", ":"))
+    return len(words)
+
+
+# ==================== BENCHMARK ====================
+
+_SUBJECTS = ["Today", "This morning", "Work", "My sleep", "The walk", "Dinner with friends", "The exam"]
+_PHRASES = [
+    "was good", "was not good", "was really bad", "felt very calm", "made me anxious", "was terrible",
+    "was a great success", "was not a bad experience", "felt lonely and sad", "was okay I guess",
+    "was amazing!", "left me tired and stressed", "was wonderful and peaceful", "felt hopeless",
+    "was extremely happy", "was never easy", "was fine", "was horribly stressful",
+]
+
+
+def synthetic_corpus(n, seed=0):
+    rng = random.Random(seed)
+    return [" ".join(f"{rng.choice(_SUBJECTS)} {rng.choice(_PHRASES)}." for _ in range(rng.randint(1, 4)))
+            for _ in range(n)]
+
+
+def load_corpus(path):
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return [e.get("journal", "") for e in data if isinstance(e.get("journal"), str) and e["journal"].strip()]
+
+
+def benchmark(texts, engine_names=("textblob", "lexicon")):
+    """Time each engine on texts and compare every engine against the first"""
+    results = {}
+    for name in engine_names:
+        try:
+            engine = ENGINES[name]()
+        except ImportError:
+            continue
+        engine.score_many(texts[:20])  # warm-up
+        start = time.perf_counter()
+        scores = engine.score_many(texts)
+        elapsed = time.perf_counter() - start
+        results[name] = {"seconds": elapsed, "texts_per_second": len(texts) / elapsed if elapsed else 0.0,
+                         "scores": scores}
+    names = list(results)
+    if len(names) > 1:
+        ref = results[names[0]]["scores"]
+        for name in names[1:]:
+            results[name]["agreement"] = agreement(ref, results[name]["scores"])
+    return results
+
+
+def _sign(x, eps=0.05):
+    return 0 if abs(x) < eps else (1 if x > 0 else -1)
+
+
+def agreement(a, b):
+    n = len(a)
+    if not n:
+        return {}
+    mean_a, mean_b = sum(a) / n, sum(b) / n
+    cov = sum((x - mean_a) * (y - mean_b) for x, y in zip(a, b))
+    var_a = sum((x - mean_a) ** 2 for x in a)
+    var_b = sum((y - mean_b) ** 2 for y in b)
+    return {
+        "sign_agreement": sum(_sign(x) == _sign(y) for x, y in zip(a, b)) / n,
+        "mean_abs_diff": sum(abs(x - y) for x, y in zip(a, b)) / n,
+        "pearson": cov / (var_a * var_b) ** 0.5 if var_a and var_b else 0.0,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sentiment engine tools")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_bench = sub.add_parser("bench", help="speed and agreement report")
+    p_bench.add_argument("--corpus", help="entries JSON file to take journals from")
+    p_bench.add_argument("--n", type=int, default=5000, help="synthetic texts to add")
+    p_build = sub.add_parser("build-lexicon", help="regenerate the lexicon from TextBlob's data")
+    p_build.add_argument("--out", default=None)
+    args = parser.parse_args(argv)
+
+    if args.command == "build-lexicon":
+        print(f"[OK] Wrote {build_lexicon(args.out)} words to {args.out or LEXICON_FILE}")
+        return 0
+
+    texts = (load_corpus(args.corpus) if args.corpus else []) + synthetic_corpus(args.n)
+    results = benchmark(texts)
+    print(f"Corpus: {len(texts)} texts")
+    for name, r in results.items():
+        print(f"{name:<10} {r['seconds']:.3f}s  {r['texts_per_second']:,.0f} texts/s")
+        if "agreement" in r:
+            a = r["agreement"]
+            print(f"{'':<10} vs {list(results)[0]}: sign agreement {a['sign_agreement']:.1%}, "
+                  f"mean |diff| {a['mean_abs_diff']:.3f}, pearson {a['pearson']:.3f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,513 @@
+"""
+sharding.py - Consistent-hash placement of user data across shard directories
+
+When SHARDS_FILE exists it lists the shard directories. Each shard holds its
+own users.json, entries.json and chat_history.json (plus per-user files such
+as achievements.json), and a consistent hash ring maps every username to
+exactly one of them. Per-user reads and writes
+therefore only touch that user's shard. When SHARDS_FILE is absent, sharding
+is off and the original single files in the working directory are used.
+
+Adding a shard moves only the users whose ring position now falls on the new
+shard. While a rebalance runs, the previous shard list is kept in the config.
+Reads for a user then also consult the user's previous shard, so data stays
+visible until the move is done, and the first write copies it forward.
+
+    python sharding.py init data/shard0 data/shard1 data/shard2 --import
+    python sharding.py add-shard data/shard3
+    python sharding.py status
+
+The file primitives the data modules share live here too: atomic JSON
+writes through a per-writer temp file, and a cross-process file lock.
+"""
+
+import os
+import sys
+import json
+import time
+import bisect
+import hashlib
+import argparse
+import threading
+from contextlib import contextmanager, ExitStack
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SHARDS_FILE = os.getenv("SHARDS_FILE", "shards.json")
+VIRTUAL_NODES = 64
+DATA_FILES = ("users.json", "entries.json", "chat_history.json")
+# Other files holding one record per username that move along with the user
+USER_FILES = ("achievements.json",)
+# Where the single set of files lives when sharding is off; its .lock guards them
+DATA_DIR = "."
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes"""
+
+    def __init__(self, shards, vnodes=VIRTUAL_NODES):
+        self.shards = list(shards)
+        self._points = []
+        self._owners = []
+        for point, shard in sorted((_hash(f"{shard}#{i}"), shard) for shard in self.shards for i in range(vnodes)):
+            self._points.append(point)
+            self._owners.append(shard)
+
+    def owner(self, key):
+        if not self._points:
+            raise ValueError("hash ring has no shards")
+        i = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[i]
+
+
+# ==================== CONFIGURATION ====================
+
+_config_key = None
+_ring = None
+_previous_ring = None
+
+
+def _load_config():
+    """(Re)read SHARDS_FILE when it changes; returns (ring, previous_ring)"""
+    global _config_key, _ring, _previous_ring
+    try:
+        st = os.stat(SHARDS_FILE)
+        key = (SHARDS_FILE, st.st_mtime_ns, st.st_size)
+    except OSError:
+        key = None
+    if key != _config_key:
+        ring = previous = None
+        if key is not None:
+            with open(SHARDS_FILE, "r", encoding="utf-8") as f:
+                config = json.load(f)
+            ring = HashRing(config["shards"])
+            if config.get("previous"):
+                previous = HashRing(config["previous"])
+        _config_key, _ring, _previous_ring = key, ring, previous
+    return _ring, _previous_ring
+
+
+def write_config(shards, previous=None):
+    config = {"shards": list(shards), "previous": list(previous) if previous else None}
+    write_json_atomic(SHARDS_FILE, config, indent=2)
+    for shard in shards:
+        os.makedirs(shard, exist_ok=True)
+
+
+def enabled():
+    return _load_config()[0] is not None
+
+
+def shard_dirs():
+    """Every directory that may currently hold data (current and previous)"""
+    ring, previous = _load_config()
+    if ring is None:
+        return []
+    dirs = list(ring.shards)
+    if previous is not None:
+        dirs += [d for d in previous.shards if d not in dirs]
+    return dirs
+
+
+def owner(username):
+    ring, _ = _load_config()
+    return ring.owner(username) if ring is not None else None
+
+
+def rebalancing():
+    """True while a previous shard list is kept, i.e. users may be mid-move"""
+    return _load_config()[1] is not None
+
+
+def moving(username):
+    """True if a rebalance may leave copies of username's records on two shards"""
+    ring, previous = _load_config()
+    return previous is not None and username is not None and previous.owner(username) != ring.owner(username)
+
+
+def user_dirs(username):
+    """Shard directories that may hold username's data (owner, and previous owner mid-rebalance)"""
+    return {os.path.dirname(p) for p, _ in read_paths(DATA_FILES[0], username)}
+
+
+# ==================== ROUTING ====================
+
+def write_path(path, username=None):
+    """File to write for `username`, given the unsharded path of that file"""
+    ring, _ = _load_config()
+    if ring is None:
+        return path
+    if username is None:
+        raise ValueError("a username is required to write while sharding is enabled")
+    return os.path.join(ring.owner(username), os.path.basename(path))
+
+
+def read_paths(path, username=None):
+    """Files to read as (path, only_username) pairs.
+
+    only_username is None for files whose whole content belongs in the
+    result. It is set for a previous-owner shard, from which only that user's
+    records should be taken. Without a username, every shard is listed, for
+    full scans.
+    """
+    ring, previous = _load_config()
+    if ring is None:
+        return [(path, None)]
+    name = os.path.basename(path)
+    if username is None:
+        return [(os.path.join(d, name), None) for d in shard_dirs()]
+    paths = [(os.path.join(ring.owner(username), name), None)]
+    if previous is not None and previous.owner(username) != ring.owner(username):
+        paths.append((os.path.join(previous.owner(username), name), username))
+    return paths
+
+
+def merge_users(users, data, only=None):
+    """Fold one users dict into `users`; earlier sources win"""
+    for name, record in data.items():
+        if only is None or name == only:
+            users.setdefault(name, record)
+    return users
+
+
+def _record_key(record):
+    return json.dumps(record, sort_keys=True, ensure_ascii=False)
+
+
+def merge_entries(entries, data, only=None):
+    """Append entries from `data`, skipping ones already present (moved copies)"""
+    if only is None and not entries:
+        entries.extend(data)
+        return entries
+    seen = {_record_key(e) for e in entries}
+    for e in data:
+        if (only is None or e.get("username") == only) and _record_key(e) not in seen:
+            entries.append(e)
+    return entries
+
+
+def merge_chat_history(all_history, data, only=None):
+    for name, history in data.items():
+        if only is not None and name != only:
+            continue
+        if name not in all_history:
+            all_history[name] = list(history)
+            continue
+        seen = {_record_key(m) for m in all_history[name]}
+        combined = all_history[name] + [m for m in history if _record_key(m) not in seen]
+        all_history[name] = sorted(combined, key=lambda m: m.get("timestamp", ""))
+    return all_history
+
+
+# ==================== FILES ====================
+
+@contextmanager
+def atomic_write(path, mode="w"):
+    """Open a temp file next to path that replaces path once the block succeeds.
+
+    The temp name is unique per process and thread, so concurrent writers
+    never truncate or rename each other's half-written file.
+    """
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, encoding=None if "b" in mode else "utf-8") as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def write_json_atomic(path, data, **dump_kwargs):
+    """Write JSON so concurrent readers never see a partial file"""
+    dump_kwargs.setdefault("ensure_ascii", False)
+    with atomic_write(path) as f:
+        json.dump(data, f, **dump_kwargs)
+
+
+# ==================== LOCKING ====================
+
+_held = threading.local()
+LOCK_TIMEOUT = 10.0
+
+
+class LockTimeout(TimeoutError):
+    """A lock stayed busy for LOCK_TIMEOUT seconds, e.g. behind a long compaction"""
+
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def file_lock(lock_path):
+    """Cross-process lock on lock_path (re-entrant per thread).
+
+    The lock is an OS lock on the open file rather than the file's
+    existence, so it is released if the holder crashes and stays valid
+    however long a compaction or rebalance holds it. Raises LockTimeout
+    after LOCK_TIMEOUT seconds.
+    """
+    counts = getattr(_held, "counts", None)
+    if counts is None:
+        counts = _held.counts = {}
+    if counts.get(lock_path):
+        counts[lock_path] += 1
+        try:
+            yield
+        finally:
+            counts[lock_path] -= 1
+        return
+
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR)
+    try:
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not _try_lock(fd):
+            if time.monotonic() > deadline:
+                raise LockTimeout(f"could not acquire {lock_path} within {LOCK_TIMEOUT:g}s")
+            time.sleep(0.002)
+        counts[lock_path] = 1
+        try:
+            yield
+        finally:
+            counts[lock_path] = 0
+            _unlock(fd)
+    finally:
+        # The lock file itself is left in place for the next holder
+        os.close(fd)
+
+
+def lock_dir(directory):
+    """Cross-process lock on one data directory: a shard, or DATA_DIR when unsharded"""
+    os.makedirs(directory, exist_ok=True)
+    return file_lock(os.path.join(directory, ".lock"))
+
+
+@contextmanager
+def lock_for(username=None):
+    """Lock the shard(s) holding `username` (all shards if None).
+
+    When sharding is off every user shares one set of files, so this locks
+    DATA_DIR. The lock works across processes and across threads alike.
+    """
+    if not enabled():
+        dirs = [DATA_DIR]
+    elif username is None:
+        dirs = shard_dirs()
+    else:
+        dirs = user_dirs(username)
+    with ExitStack() as stack:
+        for directory in sorted(dirs):
+            stack.enter_context(lock_dir(directory))
+        yield
+
+
+# ==================== REBALANCING ====================
+
+def _read(path, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return default
+
+
+def _usernames_in(directory):
+    names = set(_read(os.path.join(directory, "users.json"), {}))
+    names.update(e.get("username") for e in _read(os.path.join(directory, "entries.json"), []) if e.get("username"))
+    names.update(_read(os.path.join(directory, "chat_history.json"), {}))
+    for name in USER_FILES:
+        names.update(_read(os.path.join(directory, name), {}))
+    return names
+
+
+def move_user(username, src, dst):
+    """Copy one user's records from src to dst, then remove them from src"""
+    with lock_dir(min(src, dst)), lock_dir(max(src, dst)):
+        users_src = _read(os.path.join(src, "users.json"), {})
+        entries_src = _read(os.path.join(src, "entries.json"), [])
+        chats_src = _read(os.path.join(src, "chat_history.json"), {})
+
+        if username in users_src:
+            users_dst = _read(os.path.join(dst, "users.json"), {})
+            write_json_atomic(os.path.join(dst, "users.json"), merge_users(users_dst, users_src, username))
+        mine = [e for e in entries_src if e.get("username") == username]
+        if mine:
+            entries_dst = _read(os.path.join(dst, "entries.json"), [])
+            write_json_atomic(os.path.join(dst, "entries.json"), merge_entries(entries_dst, mine, username))
+        if username in chats_src:
+            chats_dst = _read(os.path.join(dst, "chat_history.json"), {})
+            write_json_atomic(os.path.join(dst, "chat_history.json"), merge_chat_history(chats_dst, chats_src, username))
+        for name in USER_FILES:
+            records_src = _read(os.path.join(src, name), {})
+            if username in records_src:
+                records_dst = _read(os.path.join(dst, name), {})
+                write_json_atomic(os.path.join(dst, name), merge_users(records_dst, records_src, username))
+
+        # Everything is safely on dst; now drop the source copies
+        if username in users_src:
+            del users_src[username]
+            write_json_atomic(os.path.join(src, "users.json"), users_src)
+        if mine:
+            write_json_atomic(os.path.join(src, "entries.json"), [e for e in entries_src if e.get("username") != username])
+        if username in chats_src:
+            del chats_src[username]
+            write_json_atomic(os.path.join(src, "chat_history.json"), chats_src)
+        for name in USER_FILES:
+            records_src = _read(os.path.join(src, name), {})
+            if username in records_src:
+                del records_src[username]
+                write_json_atomic(os.path.join(src, name), records_src)
+        return len(mine)
+
+
+def rebalance(progress=None):
+    """Move every misplaced user to its owner, then finish the pending rebalance"""
+    ring, previous = _load_config()
+    if ring is None:
+        raise RuntimeError(f"sharding is not configured ({SHARDS_FILE} not found)")
+    moved = 0
+    for directory in shard_dirs():
+        for username in sorted(_usernames_in(directory)):
+            target = ring.owner(username)
+            if target != directory:
+                count = move_user(username, directory, target)
+                moved += 1
+                if progress:
+                    progress(username, directory, target, count)
+    write_config(ring.shards)
+    return moved
+
+
+def add_shard(directory, progress=None):
+    """Add a shard online: publish the new ring first, then migrate users"""
+    ring, previous = _load_config()
+    if ring is None:
+        raise RuntimeError(f"sharding is not configured ({SHARDS_FILE} not found)")
+    if directory in ring.shards:
+        raise ValueError(f"{directory} is already a shard")
+    # Keep the oldest ring as "previous" if an earlier rebalance was interrupted
+    write_config(ring.shards + [directory], previous=(previous or ring).shards)
+    return rebalance(progress)
+
+
+def import_files(users_file="users.json", entries_file="entries.json", chat_history_file="chat_history.json"):
+    """Copy unsharded data files into the shards owning each user.
+
+    Entries without a username cannot be placed and are skipped. Returns
+    (users, entries, skipped_entries).
+    """
+    ring, _ = _load_config()
+    if ring is None:
+        raise RuntimeError(f"sharding is not configured ({SHARDS_FILE} not found)")
+    placed = {d: ({}, [], {}) for d in ring.shards}
+    for name, record in _read(users_file, {}).items():
+        placed[ring.owner(name)][0][name] = record
+    skipped = 0
+    for entry in _read(entries_file, []):
+        if not entry.get("username"):
+            skipped += 1
+            continue
+        placed[ring.owner(entry["username"])][1].append(entry)
+    for name, history in _read(chat_history_file, {}).items():
+        placed[ring.owner(name)][2][name] = history
+    n_users = n_entries = 0
+    for directory, (users, entries, chats) in placed.items():
+        with lock_dir(directory):
+            write_json_atomic(os.path.join(directory, "users.json"),
+                   merge_users(_read(os.path.join(directory, "users.json"), {}), users))
+            write_json_atomic(os.path.join(directory, "entries.json"),
+                   merge_entries(_read(os.path.join(directory, "entries.json"), []), entries))
+            write_json_atomic(os.path.join(directory, "chat_history.json"),
+                   merge_chat_history(_read(os.path.join(directory, "chat_history.json"), {}), chats))
+        n_users += len(users)
+        n_entries += len(entries)
+    return n_users, n_entries, skipped
+
+
+def status():
+    ring, previous = _load_config()
+    if ring is None:
+        return None
+    return {
+        "shards": {d: len(_usernames_in(d)) for d in shard_dirs()},
+        "rebalancing": previous is not None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage user data shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_init = sub.add_parser("init", help="create the shard config")
+    p_init.add_argument("dirs", nargs="+")
+    p_init.add_argument("--import", dest="import_files", action="store_true",
+                        help="copy the existing users.json/entries.json/chat_history.json into the shards")
+    p_add = sub.add_parser("add-shard", help="add a shard and move users onto it")
+    p_add.add_argument("dir")
+    sub.add_parser("rebalance", help="finish an interrupted rebalance")
+    sub.add_parser("status", help="users per shard")
+    args = parser.parse_args(argv)
+
+    def report(username, src, dst, count):
+        print(f"  moved {username}: {src} -> {dst} ({count} entries)")
+
+    if args.command == "init":
+        if os.path.exists(SHARDS_FILE):
+            print(f"{SHARDS_FILE} already exists.")
+            return 1
+        write_config(args.dirs)
+        print(f"[OK] {len(args.dirs)} shards configured in {SHARDS_FILE}")
+        if args.import_files:
+            users, entries, skipped = import_files()
+            print(f"[OK] Imported {users} users and {entries} entries ({skipped} entries without a username skipped)")
+    elif args.command == "add-shard":
+        moved = add_shard(args.dir, report)
+        print(f"[OK] Added {args.dir}; moved {moved} users")
+    elif args.command == "rebalance":
+        moved = rebalance(report)
+        print(f"[OK] Rebalance complete; moved {moved} users")
+    else:
+        info = status()
+        if info is None:
+            print("Sharding is not configured.")
+            return 1
+        for directory, count in info["shards"].items():
+            print(f"{directory}: {count} users")
+        if info["rebalancing"]:
+            print("Rebalance in progress.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
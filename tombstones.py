@@ -0,0 +1,276 @@
+"""
+tombstones.py - Deferred account deletion for the JSON data files
+
+Deleting an account appends one tombstone line to TOMBSTONES_FILE instead of
+rewriting users.json, entries.json and chat_history.json. Loaders filter
+tombstoned usernames out straight away, so the account disappears for readers
+immediately; a background compactor physically removes the data later, either
+on a schedule or once enough tombstones have piled up.
+
+Appends to TOMBSTONES_FILE are serialized across processes by a lock file
+next to it. A compaction rewrites one shard at a time under that shard's data
+lock only, so writes for users elsewhere carry on, and it removes only the
+tombstones it applied: a delete that lands while it runs waits for the next.
+"""
+
+import os
+import json
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+import sharding
+import reminders
+import analytics
+import changes
+import response_cache
+
+load_dotenv()
+
+TOMBSTONES_FILE = "tombstones.jsonl"
+USERS_FILE = "users.json"
+ENTRIES_FILE = "entries.json"
+CHAT_HISTORY_FILE = "chat_history.json"
+ACHIEVEMENTS_FILE = "achievements.json"
+
+# Seconds between scheduled compactions, and the number of pending tombstones
+# that triggers one early. Either can be overridden in .env.
+COMPACTION_INTERVAL = float(os.getenv("COMPACTION_INTERVAL_SECONDS", "3600"))
+COMPACTION_THRESHOLD = int(os.getenv("COMPACTION_TOMBSTONE_THRESHOLD", "50"))
+
+_cache_key = None
+_cache_names = frozenset()
+
+
+def _file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def _line_username(line):
+    try:
+        return json.loads(line)["username"]
+    except Exception:
+        return None
+
+
+def deleted_usernames():
+    """Return the set of usernames with a pending tombstone"""
+    global _cache_key, _cache_names
+    key = _file_key(TOMBSTONES_FILE)
+    if key == _cache_key:
+        return _cache_names
+    names = set()
+    if key is not None:
+        with open(TOMBSTONES_FILE, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                name = _line_username(line)
+                if name is not None:
+                    names.add(name)
+    _cache_key, _cache_names = key, frozenset(names)
+    return _cache_names
+
+
+def is_deleted(username):
+    return username in deleted_usernames()
+
+
+def pending_count():
+    return len(deleted_usernames())
+
+
+def _tombstones_lock():
+    """Cross-process lock for appending to or rewriting TOMBSTONES_FILE"""
+    return sharding.file_lock(TOMBSTONES_FILE + ".lock")
+
+
+def _tombstone_lines():
+    try:
+        with open(TOMBSTONES_FILE, "r", encoding="utf-8") as f:
+            return [line for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+
+def add_tombstone(username):
+    """Mark an account as deleted with a single appended line"""
+    record = {"username": username, "deleted_at": datetime.now().isoformat()}
+    with _tombstones_lock():
+        with open(TOMBSTONES_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def filter_users(users):
+    dead = deleted_usernames()
+    if not dead:
+        return users
+    return {u: p for u, p in users.items() if u not in dead}
+
+
+def filter_entries(entries):
+    dead = deleted_usernames()
+    if not dead:
+        return entries
+    return [e for e in entries if e.get("username") not in dead]
+
+
+def filter_chat_history(all_history):
+    dead = deleted_usernames()
+    if not dead:
+        return all_history
+    return {u: h for u, h in all_history.items() if u not in dead}
+
+
+def _rewrite(path, dead):
+    """Drop dead users from one JSON data file in place; returns how many records were dropped"""
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception:
+        return 0
+    if isinstance(data, dict):
+        kept = {u: v for u, v in data.items() if u not in dead}
+    else:
+        kept = [r for r in data if not (isinstance(r, dict) and r.get("username") in dead)]
+    removed = len(data) - len(kept)
+    if removed:
+        sharding.write_json_atomic(path, kept, indent=2)
+    return removed
+
+
+def _shards(usernames=None):
+    """(directory to lock, shard directory or None for the unsharded files) per shard to compact"""
+    if not sharding.enabled():
+        return [(sharding.DATA_DIR, None)]
+    if usernames is None:
+        dirs = sharding.shard_dirs()
+    else:
+        dirs = set().union(*(sharding.user_dirs(name) for name in usernames))
+    return [(d, d) for d in sorted(dirs)]
+
+
+def compact(users_file=None, entries_file=None, chat_history_file=None, achievements_file=None, usernames=None):
+    """Physically remove tombstoned accounts from the data files.
+
+    Given usernames, only their tombstones are applied and only the shards
+    holding them are rewritten. Returns a summary dict with the number of
+    users, entries, chat histories, achievement records, reminder
+    preferences and cached AI replies that were reclaimed, of cached
+    analytics days dropped for re-aggregation, and of change feed records
+    whose content was redacted.
+    """
+    summary = {"users": 0, "entries": 0, "chat_histories": 0, "achievements": 0, "reminders": 0,
+               "ai_replies": 0, "analytics_days": 0, "changes": 0}
+    with _tombstones_lock():
+        applied = _tombstone_lines()
+    if usernames is not None:
+        wanted = set(usernames)
+        applied = [line for line in applied if _line_username(line) in wanted]
+    if not applied:
+        return summary
+    names = {_line_username(line) for line in applied} - {None}
+    files = (("users", users_file or USERS_FILE),
+             ("entries", entries_file or ENTRIES_FILE),
+             ("chat_histories", chat_history_file or CHAT_HISTORY_FILE),
+             ("achievements", achievements_file or ACHIEVEMENTS_FILE))
+    for lock_dir, shard in _shards(names if usernames is not None else None):
+        with sharding.lock_dir(lock_dir):
+            # A name re-registered since the snapshot has lost its tombstone
+            # and keeps its new data
+            dead = names & deleted_usernames()
+            if not dead:
+                continue
+            for key, path in files:
+                summary[key] += _rewrite(path if shard is None else os.path.join(shard, os.path.basename(path)), dead)
+    dead = names & deleted_usernames()
+    if dead:
+        summary["reminders"] = reminders.forget_users(dead)
+        summary["ai_replies"] = response_cache.forget_users(dead)
+        summary["analytics_days"] = analytics.forget_users(dead)
+        summary["changes"] = changes.forget_users(dead)
+    # Drop the applied tombstones; ones appended meanwhile wait for the next run
+    with _tombstones_lock():
+        done = Counter(applied)
+        remaining = []
+        for line in _tombstone_lines():
+            if done[line]:
+                done[line] -= 1
+            else:
+                remaining.append(line)
+        if remaining:
+            with sharding.atomic_write(TOMBSTONES_FILE) as f:
+                f.writelines(remaining)
+        elif os.path.exists(TOMBSTONES_FILE):
+            os.remove(TOMBSTONES_FILE)
+    deleted_usernames()
+    return summary
+
+
+def maybe_compact(threshold=None, **paths):
+    """Compact only if the pending tombstone count has reached the threshold"""
+    threshold = COMPACTION_THRESHOLD if threshold is None else threshold
+    if pending_count() >= max(1, threshold):
+        return compact(**paths)
+    return None
+
+
+class Compactor:
+    """Background thread that compacts on a schedule or size threshold"""
+
+    def __init__(self, interval=None, threshold=None, poll=5.0, **paths):
+        self.interval = COMPACTION_INTERVAL if interval is None else interval
+        self.threshold = COMPACTION_THRESHOLD if threshold is None else threshold
+        self.poll = min(poll, self.interval)
+        self.paths = paths
+        self.last_run = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="tombstone-compactor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _due(self):
+        pending = pending_count()
+        if not pending:
+            return False
+        if pending >= self.threshold:
+            return True
+        return time.monotonic() - self.last_run >= self.interval
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            if self._due():
+                try:
+                    compact(**self.paths)
+                except Exception:
+                    pass
+                self.last_run = time.monotonic()
+
+
+def start_compactor(**kwargs):
+    return Compactor(**kwargs).start()
+
+
+if __name__ == "__main__":
+    print(f"Pending tombstones: {pending_count()}")
+    result = compact()
+    print(f"Reclaimed {result['users']} users, {result['entries']} entries, {result['chat_histories']} chat histories, "
+          f"{result['achievements']} achievement records, {result['reminders']} reminder preferences, "
+          f"{result['ai_replies']} cached AI replies; "
+          f"dropped {result['analytics_days']} cached analytics days; redacted {result['changes']} changes")
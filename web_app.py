@@ -3,16 +3,29 @@ Enhanced Interactive Mental Wellness Bot - Web Application
 Features: AI Chatbot, Animated Breathing Exercise, Mood Tracking, Journaling, Achievements
 """
 
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, Response, stream_with_context
 import os
 import json
 from datetime import date, datetime, timedelta
-from textblob import TextBlob
 from dotenv import load_dotenv
 import random
+import hmac
+import shutil
+import tombstones
+import sharding
+import responders
+import profiling
+import reminders
+import analytics
+import sentiment
+import records
+import achievements
+import changes
+import coalesce
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+profiling.init_app(app)
 
 USERS_FILE = "users.json"
 ENTRIES_FILE = "entries.json"
@@ -20,59 +33,115 @@ CHAT_HISTORY_FILE = "chat_history.json"
 
 load_dotenv()
 
+# Operator endpoints under /admin are disabled unless ADMIN_TOKEN is set
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+pattern_responder = responders.PatternResponder()
+chat_service = responders.build_chat_service(pattern_responder)
+
+# Concurrent requests for the same user's stats and achievements share one computation
+coalescer = coalesce.SingleFlight()
+
+# Data files that tombstone compaction reclaims deleted accounts from
+COMPACTION_FILES = dict(users_file=USERS_FILE,
+                        entries_file=ENTRIES_FILE,
+                        chat_history_file=CHAT_HISTORY_FILE,
+                        achievements_file=achievements.ACHIEVEMENTS_FILE)
+
 # ==================== HELPER FUNCTIONS ====================
 
-def load_users():
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {}
+def locked_storage(username=None):
+    """Serialize read-modify-write of the user's data files across threads and processes"""
+    return sharding.lock_for(username)
 
-def save_users(users):
-    with open(USERS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(users, f, ensure_ascii=False, indent=2)
+def read_json(path, default):
+    """Parse a data file; a missing file gives `default`.
 
-def load_entries():
-    if os.path.exists(ENTRIES_FILE):
-        with open(ENTRIES_FILE, 'r', encoding='utf-8') as f:
+    An unreadable file is first copied to <path>.corrupt, because the next
+    save would otherwise replace the only copy. A cut-off array still gives
+    its complete records; anything else unreadable gives `default`.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
             return json.load(f)
-    return []
+    except FileNotFoundError:
+        return default
+    except (OSError, ValueError) as e:
+        app.logger.warning('Could not read %s: %s', path, e)
+        try:
+            shutil.copyfile(path, path + '.corrupt')
+            if isinstance(default, list):
+                return list(records.iter_records(path))
+        except OSError:
+            pass
+        return default
 
-def save_entries(entries):
-    with open(ENTRIES_FILE, 'w', encoding='utf-8') as f:
-        json.dump(entries, f, ensure_ascii=False, indent=2)
+def load_users(username=None):
+    """Load users; given a username, only the shard holding that user is read"""
+    users = {}
+    for path, only in sharding.read_paths(USERS_FILE, username):
+        sharding.merge_users(users, read_json(path, {}), only)
+    return tombstones.filter_users(users)
+
+def save_users(users, username=None):
+    sharding.write_json_atomic(sharding.write_path(USERS_FILE, username), users, indent=2)
+
+def load_entries(username=None):
+    """Load entries; given a username, only the shard holding that user is read"""
+    entries = []
+    for path, only in sharding.read_paths(ENTRIES_FILE, username):
+        sharding.merge_entries(entries, read_json(path, []), only)
+    return tombstones.filter_entries(entries)
+
+def save_entries(entries, username=None):
+    sharding.write_json_atomic(sharding.write_path(ENTRIES_FILE, username), entries, indent=2)
+
+def load_user_entries(username):
+    """Read-only view of one user's entries as compact Entry records"""
+    return records.load_user_entries(ENTRIES_FILE, username)
 
 def load_chat_history(username):
-    if os.path.exists(CHAT_HISTORY_FILE):
+    if tombstones.is_deleted(username):
+        return []
+    all_history = {}
+    for path, only in sharding.read_paths(CHAT_HISTORY_FILE, username):
         try:
-            with open(CHAT_HISTORY_FILE, 'r', encoding='utf-8') as f:
-                all_history = json.load(f)
-                return all_history.get(username, [])
+            sharding.merge_chat_history(all_history, read_json(path, {}), username)
         except:
-            return []
-    return []
+            pass
+    return all_history.get(username, [])
 
 def save_chat_history(username, history):
-    all_history = {}
-    if os.path.exists(CHAT_HISTORY_FILE):
+    path = sharding.write_path(CHAT_HISTORY_FILE, username)
+    with locked_storage(username):
         try:
-            with open(CHAT_HISTORY_FILE, 'r', encoding='utf-8') as f:
-                all_history = json.load(f)
+            all_history = read_json(path, {})
         except:
-            pass
-    
-    all_history[username] = history
-    with open(CHAT_HISTORY_FILE, 'w', encoding='utf-8') as f:
-        json.dump(all_history, f, ensure_ascii=False, indent=2)
+            all_history = {}
+        
+        all_history[username] = history
+        sharding.write_json_atomic(path, all_history, indent=2)
+
+def append_chat_message(username, user_message, bot_response):
+    """Record one chat exchange in the user's history"""
+    message = {
+        'timestamp': datetime.now().isoformat(),
+        'user': user_message,
+        'bot': bot_response
+    }
+    with locked_storage(username):
+        chat_history = load_chat_history(username)
+        chat_history.append(message)
+        save_chat_history(username, chat_history)
+        changes.record('chat.message', username, message)
+
+def start_background_compaction():
+    """Start the thread that reclaims space held by deleted accounts"""
+    return tombstones.start_compactor(**COMPACTION_FILES)
 
 def get_sentiment(text):
     """Calculate sentiment score from text (-1.0 to 1.0)"""
-    if not text:
-        return 0.0
-    try:
-        return TextBlob(text).sentiment.polarity
-    except:
-        return 0.0
+    return sentiment.get_engine().score(text)
 
 def get_mood_color(mood):
     """Return color code for mood"""
@@ -92,13 +161,12 @@ def get_mood_color(mood):
             return color
     return "#667eea"
 
-def calculate_streak(username):
-    """Calculate current mood tracking streak"""
-    entries = [e for e in load_entries() if e.get('username') == username]
+def streak_from_entries(entries):
+    """Length of the run of daily entries ending at the most recent one"""
     if not entries:
         return 0
     
-    entries.sort(key=lambda x: x.get('date', ''), reverse=True)
+    entries = sorted(entries, key=lambda x: x.get('date', ''), reverse=True)
     streak = 1
     for i in range(len(entries) - 1):
         try:
@@ -113,23 +181,38 @@ def calculate_streak(username):
             break
     return streak
 
-def get_achievements(username):
-    """Get user's achievements based on activity"""
-    entries = [e for e in load_entries() if e.get('username') == username]
-    achievements = []
+def compute_user_stats(username):
+    """Last-7-day statistics plus streak, from one read of the user's entries"""
+    entries = load_user_entries(username)
     
-    if len(entries) >= 1:
-        achievements.append({"name": "Getting Started", "icon": "🌱", "desc": "Record your first entry"})
-    if len(entries) >= 7:
-        achievements.append({"name": "Consistent", "icon": "📝", "desc": "Log 7 entries"})
-    if len(entries) >= 30:
-        achievements.append({"name": "Dedicated", "icon": "⭐", "desc": "Log 30 entries"})
+    last7 = datetime.now() - timedelta(days=7)
+    last7_entries = [e for e in entries if datetime.fromisoformat(e.get('date', '')) >= last7]
     
-    streak = calculate_streak(username)
-    if streak >= 7:
-        achievements.append({"name": "On Fire!", "icon": "🔥", "desc": f"{streak} day streak"})
+    total_entries_7d = len(last7_entries)
+    exercises_count = sum(1 for e in last7_entries if e.get('exercise'))
+    avg_sentiment = round(sum(e.get('sentiment', 0) for e in last7_entries) / max(1, total_entries_7d), 2)
+    
+    mood_dist = {}
+    for entry in last7_entries:
+        mood = entry.get('mood', 'Unknown')
+        mood_dist[mood] = mood_dist.get(mood, 0) + 1
     
-    return achievements
+    return {
+        'total_entries': total_entries_7d,
+        'total_all_time': len(entries),
+        'exercises_done': exercises_count,
+        'avg_sentiment': avg_sentiment,
+        'streak': streak_from_entries(entries),
+        'mood_distribution': mood_dist
+    }
+
+def get_user_stats(username):
+    """User statistics, shared between concurrent requests (treat as read-only)"""
+    return coalescer.do(('stats', username), compute_user_stats, username)
+
+def get_achievements(username):
+    """Get user's unlocked achievements (kept up to date as entries are added)"""
+    return coalescer.do(('achievements', username), achievements.unlocked, username)
 
 def get_random_affirmation():
     """Get a random positive affirmation"""
@@ -173,113 +256,13 @@ def get_wellness_tip():
     ]
     return random.choice(tips)
 
-def get_ai_response(user_message):
-    """Generate an AI response using simple pattern matching and predefined responses"""
-    user_message_lower = user_message.lower().strip()
-    
-    # Define response patterns
-    responses = {
-        'greeting': {
-            'patterns': ['hi', 'hello', 'hey', 'greetings'],
-            'responses': [
-                "Hello! I'm here to support your mental wellness journey. How can I help you today?",
-                "Hi there! It's great to see you. What's on your mind?",
-                "Hey! Welcome to your wellness space. How are you feeling today?"
-            ]
-        },
-        'mood': {
-            'patterns': ['how are you', 'how do you feel', 'how are things'],
-            'responses': [
-                "I'm here to listen and support you. How have you been feeling lately?",
-                "I appreciate you asking! More importantly, how are YOU doing?",
-                "I'm doing well, thank you for asking! Tell me about your day."
-            ]
-        },
-        'anxiety': {
-            'patterns': ['anxious', 'anxiety', 'nervous', 'worried', 'stress', 'stressed'],
-            'responses': [
-                "I hear you. Anxiety can be overwhelming. Try the breathing exercise - it helps many people. Would you like to try it?",
-                "It's normal to feel anxious sometimes. Remember, this feeling is temporary. Would a guided breathing exercise help?",
-                "Anxiety is your mind trying to protect you. Let's work through this together. Try some deep breathing: inhale for 4, hold for 4, exhale for 4."
-            ]
-        },
-        'sad': {
-            'patterns': ['sad', 'depressed', 'down', 'lonely', 'alone', 'unhappy'],
-            'responses': [
-                "I'm sorry you're feeling down. It's okay to feel sad sometimes. Talking about it is a good first step.",
-                "Sadness is a natural emotion. Remember, difficult emotions don't last forever. You're stronger than you think.",
-                "It takes courage to acknowledge your feelings. Would journaling help you process what you're feeling?"
-            ]
-        },
-        'gratitude': {
-            'patterns': ['thank', 'thanks', 'grateful', 'appreciate'],
-            'responses': [
-                "You're welcome! I'm grateful to be part of your wellness journey.",
-                "Happy to help! Remember, gratitude is a powerful tool for mental health.",
-                "That's wonderful! Expressing gratitude is great for your well-being."
-            ]
-        },
-        'exercise': {
-            'patterns': ['exercise', 'workout', 'fitness', 'breathing', 'meditation'],
-            'responses': [
-                "Great! Exercise is excellent for mental health. Try our breathing exercise or quick workout routine.",
-                "Movement and mindfulness are wonderful for wellness. Would you like to try our guided breathing or meditation?",
-                "That's a fantastic idea! Physical activity boosts mood and reduces stress. Let's get started!"
-            ]
-        },
-        'sleep': {
-            'patterns': ['sleep', 'tired', 'exhausted', 'can\'t sleep', 'insomnia'],
-            'responses': [
-                "Sleep is crucial for mental health. Try our meditation exercise before bed - it can help you relax.",
-                "Lack of sleep affects mood. Try limiting screens before bed and our breathing exercise to wind down.",
-                "Feeling tired? Rest is important. Consider a short meditation or breathing exercise to help you relax."
-            ]
-        },
-        'positive': {
-            'patterns': ['great', 'good', 'excellent', 'amazing', 'wonderful', 'happy'],
-            'responses': [
-                "That's wonderful to hear! Keep up this positive momentum!",
-                "I'm so happy for you! Celebrate these moments - you deserve it!",
-                "That's fantastic! Your positive energy is inspiring. Keep going!"
-            ]
-        },
-        'help': {
-            'patterns': ['help', 'advice', 'what should', 'what can i do'],
-            'responses': [
-                "I'm here to help! You can journal your feelings, try our exercises, track your mood, or just talk to me.",
-                "There are several things we can do: practice breathing exercises, meditation, journaling, or I can chat with you.",
-                "Let's work through this together. Try one of our wellness exercises or tell me what's bothering you."
-            ]
-        },
-        'journal': {
-            'patterns': ['journal', 'write', 'entry', 'entries'],
-            'responses': [
-                "Journaling is a powerful way to process emotions. It helps you gain clarity and track your progress.",
-                "Writing down your thoughts can be therapeutic. Go ahead and create a new journal entry!",
-                "Great idea! Journaling helps you understand yourself better and track your mental wellness journey."
-            ]
-        }
-    }
-    
-    # Match user message against patterns
-    for category, data in responses.items():
-        for pattern in data['patterns']:
-            if pattern in user_message_lower:
-                return random.choice(data['responses'])
-    
-    # Default response if no pattern matches
-    default_responses = [
-        "That's interesting! Tell me more about what you're experiencing.",
-        "I understand. How does that make you feel?",
-        "Thank you for sharing. Is there something specific you'd like help with?",
-        "I'm listening. Would you like to try one of our wellness exercises?",
-        "That's valuable insight. What can I help you with today?"
-    ]
-    
-    return random.choice(default_responses)
-
 # ==================== ROUTES ====================
 
+@app.errorhandler(sharding.LockTimeout)
+def storage_busy(error):
+    """Data files stayed locked (e.g. during a compaction or rebalance); ask the client to retry"""
+    return jsonify({'error': 'Storage is busy, please try again shortly'}), 503, {'Retry-After': '5'}
+
 @app.route('/')
 def index():
     """Home page"""
@@ -291,8 +274,8 @@ def index():
 def login():
     """User login"""
     if request.method == 'POST':
-        users = load_users()
         username = request.form.get('username', '').strip()
+        users = load_users(username)
         password = request.form.get('password', '')
         
         if username in users and users[username] == password:
@@ -306,8 +289,8 @@ def login():
 def register():
     """User registration"""
     if request.method == 'POST':
-        users = load_users()
         username = request.form.get('username', '').strip()
+        users = load_users(username)
         password = request.form.get('password', '').strip()
         confirm = request.form.get('confirm_password', '').strip()
         
@@ -326,8 +309,14 @@ def register():
         if username in users:
             return render_template('register.html', error='Username already exists')
         
-        users[username] = password
-        save_users(users)
+        if tombstones.is_deleted(username):
+            # Reclaim the old account's data before the name is reused; only
+            # the shard holding it is rewritten
+            tombstones.compact(usernames=[username], **COMPACTION_FILES)
+        with locked_storage(username):
+            users = load_users(username)
+            users[username] = password
+            save_users(users, username)
         session['username'] = username
         return redirect(url_for('dashboard'))
     
@@ -339,6 +328,24 @@ def logout():
     session.pop('username', None)
     return redirect(url_for('index'))
 
+@app.route('/delete-account', methods=['POST'])
+def delete_account():
+    """Delete the current account; data is reclaimed by background compaction"""
+    if 'username' not in session:
+        return redirect(url_for('login'))
+    
+    if request.form.get('confirm', '') != 'DELETE':
+        return redirect(url_for('dashboard'))
+    
+    username = session.pop('username')
+    tombstones.add_tombstone(username)
+    changes.record('account.deleted', username)
+    coalescer.invalidate(username)
+    # The compactor thread only runs when this file is started directly, so
+    # under a WSGI server deletes also trigger compaction past the threshold
+    tombstones.maybe_compact(**COMPACTION_FILES)
+    return redirect(url_for('index'))
+
 @app.route('/dashboard')
 def dashboard():
     """Main dashboard with stats and achievements"""
@@ -346,19 +353,7 @@ def dashboard():
         return redirect(url_for('login'))
     
     username = session['username']
-    entries = [e for e in load_entries() if e.get('username') == username]
-    
-    # Calculate statistics
-    last7 = datetime.now() - timedelta(days=7)
-    last7_entries = [e for e in entries if datetime.fromisoformat(e.get('date', '')) >= last7]
-    
-    stats = {
-        'total_entries': len(last7_entries),
-        'total_all_time': len(entries),
-        'exercises_done': sum(1 for e in last7_entries if e.get('exercise')),
-        'avg_sentiment': round(sum(e.get('sentiment', 0) for e in last7_entries) / max(1, len(last7_entries)), 2),
-        'streak': calculate_streak(username)
-    }
+    stats = get_user_stats(username)
     
     achievements = get_achievements(username)
     affirmation = get_random_affirmation()
@@ -400,9 +395,14 @@ def add_entry():
             'mood_color': get_mood_color(mood)
         }
         
-        entries = load_entries()
-        entries.append(entry)
-        save_entries(entries)
+        with locked_storage(username):
+            entries = load_entries(username)
+            entries.append(entry)
+            save_entries(entries, username)
+            achievements.on_insert(username, entry)
+            changes.record('entry.created', username, entry)
+        coalescer.invalidate(username)
+        reminders.record_activity(username)
         
         return redirect(url_for('dashboard'))
     
@@ -418,7 +418,7 @@ def list_entries():
         return redirect(url_for('login'))
     
     username = session['username']
-    entries = [e for e in load_entries() if e.get('username') == username]
+    entries = load_user_entries(username)
     entries.sort(key=lambda x: x.get('date', ''), reverse=True)
     
     return render_template('entries.html', entries=entries)
@@ -430,28 +430,7 @@ def stats():
         return redirect(url_for('login'))
     
     username = session['username']
-    entries = [e for e in load_entries() if e.get('username') == username]
-    
-    last7 = datetime.now() - timedelta(days=7)
-    last7_entries = [e for e in entries if datetime.fromisoformat(e.get('date', '')) >= last7]
-    
-    total_entries_7d = len(last7_entries)
-    exercises_count = sum(1 for e in last7_entries if e.get('exercise'))
-    avg_sentiment = round(sum(e.get('sentiment', 0) for e in last7_entries) / max(1, total_entries_7d), 2)
-    
-    mood_dist = {}
-    for entry in last7_entries:
-        mood = entry.get('mood', 'Unknown')
-        mood_dist[mood] = mood_dist.get(mood, 0) + 1
-    
-    stats_data = {
-        'total_entries': total_entries_7d,
-        'total_all_time': len(entries),
-        'exercises_done': exercises_count,
-        'avg_sentiment': avg_sentiment,
-        'streak': calculate_streak(username),
-        'mood_distribution': mood_dist
-    }
+    stats_data = get_user_stats(username)
     
     return render_template('stats.html', stats=stats_data)
 
@@ -527,23 +506,63 @@ def api_chat():
     if not user_message:
         return jsonify({'error': 'Message required'}), 400
     
-    # Get AI response
-    ai_response = get_ai_response(user_message)
+    # Get AI response (falls back to pattern matching if the backend is busy or slow).
+    # With CHAT_BACKEND=llm this waits up to LLM_TIMEOUT_SECONDS on this worker;
+    # /api/chat/stream sends the reply as it is generated.
+    ai_response = chat_service.respond(user_message, username)
     
     # Save to chat history
-    chat_history = load_chat_history(username)
-    chat_history.append({
-        'timestamp': datetime.now().isoformat(),
-        'user': user_message,
-        'bot': ai_response
-    })
-    save_chat_history(username, chat_history)
+    append_chat_message(username, user_message, ai_response)
     
     return jsonify({
         'user_message': user_message,
         'bot_response': ai_response
     })
 
+@app.route('/api/chat/stream', methods=['POST'])
+def api_chat_stream():
+    """Streaming chat endpoint: sends the reply as Server-Sent Events"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    username = session['username']
+    user_message = request.json.get('message', '').strip()
+    
+    if not user_message:
+        return jsonify({'error': 'Message required'}), 400
+    
+    def generate():
+        parts = []
+        for token in chat_service.stream(user_message, username):
+            parts.append(token)
+            yield f"data: {json.dumps({'token': token})}\n\n"
+        ai_response = ''.join(parts).strip()
+        append_chat_message(username, user_message, ai_response)
+        yield f"event: done\ndata: {json.dumps({'bot_response': ai_response})}\n\n"
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/reminder', methods=['GET', 'POST'])
+def reminder_settings():
+    """Get or set the daily check-in reminder time and time zone"""
+    if 'username' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+    
+    username = session['username']
+    if request.method == 'POST':
+        data = request.json or {}
+        try:
+            pref = reminders.set_preference(username,
+                                            data.get('time', reminders.DEFAULT_TIME),
+                                            data.get('tz', reminders.DEFAULT_TZ),
+                                            data.get('enabled', True))
+        except ValueError:
+            return jsonify({'error': 'Invalid time or time zone'}), 400
+        return jsonify(pref)
+    
+    return jsonify(reminders.load_preferences().get(username, {}))
+
 @app.route('/api/affirmation')
 def get_affirmation_api():
     """API endpoint for random affirmation"""
@@ -554,6 +573,66 @@ def get_tip_api():
     """API endpoint for wellness tip"""
     return jsonify({'tip': get_wellness_tip()})
 
+def is_admin_request():
+    """True if the request carries ADMIN_TOKEN (as a Bearer token or X-Admin-Token)"""
+    auth = request.headers.get('Authorization', '')
+    token = auth[7:] if auth.startswith('Bearer ') else request.headers.get('X-Admin-Token', '')
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+@app.route('/admin/api/metrics')
+def admin_metrics():
+    """Population metrics for operators (requires ADMIN_TOKEN)"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    days = request.args.get('days', 30, type=int)
+    return jsonify(analytics.get_metrics(ENTRIES_FILE, days))
+
+@app.route('/admin/api/coalescing')
+def admin_coalescing():
+    """Request coalescing metrics for operators (requires ADMIN_TOKEN)"""
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    return jsonify(coalescer.stats())
+
+@app.route('/api/changes')
+def api_changes():
+    """Change feed after a cursor (requires ADMIN_TOKEN).
+    
+    Long-polls up to `timeout` seconds by default. With `Accept:
+    text/event-stream` (or ?stream=1) the feed is streamed as Server-Sent
+    Events whose ids are sequence numbers, so reconnecting with
+    Last-Event-ID resumes where the stream stopped.
+    """
+    if not is_admin_request():
+        return jsonify({'error': 'Forbidden'}), 403
+    
+    # A reconnecting EventSource sends Last-Event-ID; it wins over ?after=
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', 0, type=int)
+    limit = max(1, min(request.args.get('limit', 500, type=int), 1000))
+    timeout = max(0.0, min(request.args.get('timeout', 25.0, type=float), 60.0))
+    
+    if request.args.get('stream') or 'text/event-stream' in request.headers.get('Accept', ''):
+        def generate(cursor):
+            while True:
+                result = changes.wait_after(cursor, timeout or 25.0, limit)
+                if result['reset']:
+                    yield "event: reset\ndata: {}\n\n"
+                for change in result['changes']:
+                    yield f"id: {change['seq']}\nevent: {change['type']}\ndata: {json.dumps(change)}\n\n"
+                if not result['changes']:
+                    # Comment line; lets the server notice clients that went away
+                    yield ": keep-alive\n\n"
+                cursor = result['next']
+        
+        return Response(stream_with_context(generate(after)), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    
+    return jsonify(changes.wait_after(after, timeout, limit))
+
 @app.route('/export')
 def export_entries():
     """Export entries as JSON"""
@@ -561,8 +640,9 @@ def export_entries():
         return redirect(url_for('login'))
     
     username = session['username']
-    entries = [e for e in load_entries() if e.get('username') == username]
-    return jsonify(entries)
+    entries = load_user_entries(username)
+    return jsonify([e.to_dict() for e in entries])
 
 if __name__ == '__main__':
+    start_background_compaction()
     app.run(debug=True, host='127.0.0.1', port=5000)